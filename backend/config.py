@@ -1,39 +1,63 @@
 """Application configuration loaded from environment variables."""
 
+import functools
 import os
 from pathlib import Path
 
-from dotenv import load_dotenv
+from dotenv import dotenv_values
 
 ENV_PATH = Path(__file__).resolve().parent / ".env"
-load_dotenv(ENV_PATH)
+
+
+@functools.lru_cache(maxsize=None)
+def _env() -> dict[str, str]:
+    """Merge ``.env`` and the process environment once (process env wins)."""
+    file_values = {k: v for k, v in dotenv_values(ENV_PATH).items() if v is not None}
+    return {**file_values, **os.environ}
+
 
 # Paths
 BASE_DIR = Path(__file__).resolve().parent.parent
-UPLOAD_DIR = BASE_DIR / "uploads"
-OUTPUT_DIR = BASE_DIR / "outputs"
+# Both hold short-lived files only; point them at a tmpfs (e.g. /dev/shm/...)
+# to keep uploads, results and previews in RAM.
+UPLOAD_DIR = Path(_env().get("UPLOAD_DIR", str(BASE_DIR / "uploads")))
+OUTPUT_DIR = Path(_env().get("OUTPUT_DIR", str(BASE_DIR / "outputs")))
+PROMPT_CACHE_PATH = Path(_env().get("PROMPT_CACHE_PATH", str(BASE_DIR / ".prompt_cache.sqlite3")))
+
+
+@functools.lru_cache(maxsize=1)
+def ensure_dirs() -> None:
+    """Create the upload/output directories (once per process, at startup)."""
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-UPLOAD_DIR.mkdir(exist_ok=True)
-OUTPUT_DIR.mkdir(exist_ok=True)
 
 # API
-ROUTELLM_API_KEY: str = os.getenv("ROUTELLM_API_KEY", "")
+ROUTELLM_API_KEY: str = _env().get("ROUTELLM_API_KEY", "")
 ROUTELLM_BASE_URL: str = "https://routellm.abacus.ai/v1"
 ROUTELLM_MODEL: str = "claude-sonnet-4-20250514"
+HTTP_CONNECT_TIMEOUT: float = float(_env().get("HTTP_CONNECT_S", "3.0"))
+HTTP_READ_TIMEOUT: float = float(_env().get("HTTP_READ_S", "30.0"))
+LLM_VERBOSE_PROMPT: bool = _env().get("LLM_VERBOSE_PROMPT", "0") == "1"
+# Off by default: a batched call puts unrelated users' prompts in one context
+LLM_BATCH_PROMPTS: bool = _env().get("LLM_BATCH_PROMPTS", "0") == "1"
 
 # Limits
-MAX_FILE_SIZE_MB: int = int(os.getenv("MAX_FILE_SIZE_MB", "50"))
+MAX_FILE_SIZE_MB: int = int(_env().get("MAX_FILE_SIZE_MB", "50"))
 MAX_FILE_SIZE_BYTES: int = MAX_FILE_SIZE_MB * 1024 * 1024
-CLEANUP_INTERVAL_MINUTES: int = int(os.getenv("CLEANUP_INTERVAL_MINUTES", "60"))
+CLEANUP_INTERVAL_MINUTES: int = int(_env().get("CLEANUP_INTERVAL_MINUTES", "60"))
+MAX_CONCURRENT_EDITS: int = max(1, int(_env().get("MAX_CONCURRENT_EDITS", "4")))
+# Each worker process holds a full MuPDF instance, so the default is capped
+WORKER_PROCESSES: int = max(1, int(_env().get("WORKER_PROCESSES", str(min(4, os.cpu_count() or 1)))))
 
 # CryptoBot
-CRYPTOBOT_API_TOKEN: str = os.getenv("CRYPTOBOT_API_TOKEN", "")
+CRYPTOBOT_API_TOKEN: str = _env().get("CRYPTOBOT_API_TOKEN", "")
 CRYPTOBOT_API_URL: str = "https://pay.crypt.bot/api"
 
 # App / Download
-APP_BASE_URL: str = os.getenv("APP_BASE_URL", "https://pdf-text-editor.onrender.com")
-DOWNLOAD_SECRET: str = os.getenv("DOWNLOAD_SECRET", "change-me-in-production")
+APP_BASE_URL: str = _env().get("APP_BASE_URL", "https://pdf-text-editor.onrender.com")
+DOWNLOAD_SECRET: str = _env().get("DOWNLOAD_SECRET", "change-me-in-production")
 
 # Server
-HOST: str = os.getenv("HOST", "0.0.0.0")
-PORT: int = int(os.getenv("PORT", "10000"))
+HOST: str = _env().get("HOST", "0.0.0.0")
+PORT: int = int(_env().get("PORT", "10000"))
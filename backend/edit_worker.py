@@ -0,0 +1,119 @@
+"""Document editing and result saving in worker processes.
+
+Editing is CPU-bound, holds the GIL and PyMuPDF is not thread-safe, so
+``edit_and_save`` runs in the same worker processes as preview rendering
+(see ``main._get_worker_executor``). The document is opened, edited,
+saved and closed inside one call; only paths, dicts and replacement
+results cross the process boundary.
+"""
+
+import logging
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+from pdf_editor import PDF_SAVE_OPTIONS, ReplacementResult, edit_document
+from preview_renderer import release_store, warm_up as preview_warm_up
+
+logger = logging.getLogger(__name__)
+
+RESULT_JPEG_QUALITY = 95
+
+
+def warm_up() -> None:
+    """Process-pool initializer: pay one-off import and MuPDF costs up front.
+
+    Imports the optional raster fallback (if its dependencies are present)
+    and renders a blank page, so a worker's first real job is not slower
+    than the rest.
+    """
+    try:
+        import pdf_editor_raster  # noqa: F401
+    except ImportError as e:
+        logger.debug("Raster fallback unavailable: %s", e)
+
+    preview_warm_up()
+
+
+def _open_edited(
+    pdf_path: str,
+    replacements: dict[str, str],
+    case_sensitive: bool,
+) -> tuple[fitz.Document, list[ReplacementResult]]:
+    """Run replacement with PyMuPDF, fallback to raster if needed.
+
+    Returns the edited document still open; the caller must close it.
+
+    Raises:
+        RuntimeError: If PyMuPDF fails and the raster fallback is unavailable.
+    """
+    try:
+        return edit_document(pdf_path, replacements, case_sensitive)
+    except Exception as e:
+        logger.error("PyMuPDF method failed: %s", e)
+        try:
+            from pdf_editor_raster import replace_text_raster
+        except ImportError:
+            raise RuntimeError(f"PDF processing failed: {e}") from e
+        pdf_bytes, results = replace_text_raster(pdf_path, replacements)
+        return fitz.open(stream=pdf_bytes, filetype="pdf"), results
+
+
+def save_result(doc: fitz.Document, out_stem: Path, output_format: str, dpi: int) -> Path:
+    """Save the edited document as ``out_stem`` plus the format's extension.
+
+    Single-page image results are rasterised at ``dpi`` and encoded by
+    MuPDF directly, without a round-trip through PIL. Anything else is
+    saved as PDF (a multi-page image request gets all pages).
+
+    Returns:
+        Path to the saved file.
+    """
+    if output_format != "pdf" and len(doc) == 1:
+        pix = doc[0].get_pixmap(dpi=dpi, alpha=False)
+        out_path = out_stem.with_suffix(f".{output_format}")
+        if output_format == "jpg":
+            pix.save(str(out_path), output="jpeg", jpg_quality=RESULT_JPEG_QUALITY)
+        else:
+            pix.save(str(out_path), output="png")
+        return out_path
+
+    out_path = out_stem.with_suffix(".pdf")
+    # Embedded page thumbnails would still show the pre-edit text
+    doc.scrub(
+        attached_files=False, clean_pages=False, embedded_files=False, hidden_text=False,
+        javascript=False, metadata=False, redactions=False, remove_links=False,
+        reset_fields=False, reset_responses=False, thumbnails=True, xml_metadata=False,
+    )
+    doc.save(str(out_path), **PDF_SAVE_OPTIONS)
+    return out_path
+
+
+def edit_and_save(
+    pdf_path: str,
+    replacements: dict[str, str],
+    case_sensitive: bool,
+    out_stem: str,
+    output_format: str,
+    dpi: int,
+) -> tuple[str, int, list[ReplacementResult]]:
+    """Edit the upload and save the clean result.
+
+    Args:
+        pdf_path: Uploaded PDF.
+        replacements: Mapping of old_text -> new_text.
+        case_sensitive: Whether search is case-sensitive.
+        out_stem: Result path without extension.
+        output_format: ``pdf``, ``jpg`` or ``png``.
+        dpi: Rasterisation resolution for image results.
+
+    Returns:
+        Tuple of (saved result path, page count, replacement results).
+    """
+    doc, results = _open_edited(pdf_path, replacements, case_sensitive)
+    try:
+        out_path = save_result(doc, Path(out_stem), output_format, dpi)
+        return str(out_path), len(doc), results
+    finally:
+        doc.close()
+        release_store()
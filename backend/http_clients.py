@@ -0,0 +1,71 @@
+"""Shared HTTP clients for outbound API calls.
+
+A single pooled ``httpx.AsyncClient`` per upstream keeps TCP/TLS
+connections alive between requests instead of reconnecting per call.
+"""
+
+import httpx
+
+from config import (
+    CRYPTOBOT_API_TOKEN,
+    CRYPTOBOT_API_URL,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    ROUTELLM_API_KEY,
+    ROUTELLM_BASE_URL,
+)
+
+# Per-phase limits: a dead upstream fails on connect in seconds instead of
+# holding the request for the full read budget.
+HTTP_TIMEOUTS = httpx.Timeout(
+    connect=HTTP_CONNECT_TIMEOUT,
+    read=HTTP_READ_TIMEOUT,
+    write=5.0,
+    pool=1.0,
+)
+
+_routellm_client: httpx.AsyncClient | None = None
+_cryptobot_client: httpx.AsyncClient | None = None
+
+
+def get_routellm_client() -> httpx.AsyncClient:
+    """Return the process-wide RouteLLM client, creating it on first use."""
+    global _routellm_client
+    if _routellm_client is None or _routellm_client.is_closed:
+        _routellm_client = httpx.AsyncClient(
+            base_url=ROUTELLM_BASE_URL,
+            timeout=HTTP_TIMEOUTS,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+            headers={
+                "Authorization": f"Bearer {ROUTELLM_API_KEY}",
+                "Content-Type": "application/json",
+            },
+        )
+    return _routellm_client
+
+
+def get_cryptobot_client() -> httpx.AsyncClient:
+    """Return the process-wide CryptoBot client, creating it on first use."""
+    global _cryptobot_client
+    if _cryptobot_client is None or _cryptobot_client.is_closed:
+        _cryptobot_client = httpx.AsyncClient(
+            base_url=CRYPTOBOT_API_URL,
+            timeout=HTTP_TIMEOUTS,
+            limits=httpx.Limits(max_keepalive_connections=5, max_connections=20),
+            headers={
+                "Crypto-Pay-API-Token": CRYPTOBOT_API_TOKEN,
+                "Content-Type": "application/json",
+            },
+        )
+    return _cryptobot_client
+
+
+async def close_clients() -> None:
+    """Close all pooled clients (called on application shutdown)."""
+    global _routellm_client, _cryptobot_client
+    if _routellm_client is not None:
+        await _routellm_client.aclose()
+        _routellm_client = None
+    if _cryptobot_client is not None:
+        await _cryptobot_client.aclose()
+        _cryptobot_client = None
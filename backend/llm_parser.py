@@ -4,48 +4,79 @@ Takes free-form user instructions and extracts structured
 find-and-replace operations via an LLM call.
 """
 
-import json
+import asyncio
+import copy
+import functools
+import hashlib
 import logging
+import random
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
 from typing import Any
 
 import httpx
+import orjson
 
-from config import ROUTELLM_API_KEY, ROUTELLM_BASE_URL, ROUTELLM_MODEL
+from config import (
+    LLM_BATCH_PROMPTS,
+    LLM_VERBOSE_PROMPT,
+    PROMPT_CACHE_PATH,
+    ROUTELLM_API_KEY,
+    ROUTELLM_MODEL,
+)
+from http_clients import get_routellm_client
 
 logger = logging.getLogger(__name__)
 
-SYSTEM_PROMPT = """You are a precise text replacement instruction parser.
-Your job is to take a user's natural language instruction about editing text in a PDF
-and convert it into a structured JSON response.
-
-You MUST respond with ONLY valid JSON, no markdown, no explanation. The JSON schema is:
-{
-  "replacements": {
-    "old_text_1": "new_text_1",
-    "old_text_2": "new_text_2"
-  },
-  "case_sensitive": false,
-  "notes": "optional notes about limitations or assumptions"
-}
+# Leading ```lang line and trailing ``` line of a fenced reply
+_FENCE_RE = re.compile(r"\A```[^\n]*\n|\n```\s*\Z")
+_WS_RE = re.compile(r"\s+")
+
+# A parse reply is ~1 KB; anything far larger is a misbehaving upstream.
+MAX_RESPONSE_BYTES = 64 * 1024
+
+# Retry policy for transient RouteLLM failures (network errors, 429, 5xx)
+RETRY_ATTEMPTS = 3
+RETRY_INITIAL_DELAY = 0.2
+RETRY_MAX_DELAY = 2.0
+
+# Micro-batching (only with LLM_BATCH_PROMPTS): concurrent prompts arriving
+# within the window share one call
+BATCH_WINDOW_SECONDS = 0.02
+BATCH_MAX_PROMPTS = 8
 
-Rules:
-1. Extract ALL find-and-replace pairs from the user's instruction.
-2. Set case_sensitive to true only if the user explicitly requests case-sensitive matching.
-3. If the instruction is ambiguous, make your best interpretation and explain in "notes".
-4. If the user mentions constraints you cannot express (e.g., "only in headings"), note this in "notes".
-5. Handle multiple languages (English, Russian, etc.).
-6. For date-related instructions, generate all necessary replacement pairs.
+# LRU of parsed responses; temperature=0 makes the reply a function of the prompt.
+PROMPT_CACHE_SIZE = 1024
+_prompt_cache: OrderedDict[tuple[str, str], dict[str, Any]] = OrderedDict()
+_in_flight: dict[tuple[str, str], asyncio.Task] = {}
+_cache_hits = 0
 
-Examples:
+# Persistent cache shared by all workers and surviving restarts
+PROMPT_CACHE_TTL_SECONDS = 86400
 
+_CORE_RULES = """Convert the user's instruction for editing text in a PDF into find-and-replace JSON.
+Reply with ONLY this JSON, no markdown:
+{"replacements": {"old": "new"}, "case_sensitive": false, "notes": ""}
+Extract every pair (any language; for dates include the variants needed, e.g. abbreviations).
+Set case_sensitive true only if the user asks for it or casing must be preserved.
+Put assumptions and constraints you cannot express (e.g. "only in headings") in "notes".
+"""
+
+_FEW_SHOT = """
 User: "Replace 2025 with 2026"
 Response: {"replacements": {"2025": "2026"}, "case_sensitive": false, "notes": ""}
 
-User: "Change John Smith to Jane Doe everywhere"
-Response: {"replacements": {"John Smith": "Jane Doe"}, "case_sensitive": true, "notes": "Using case-sensitive to preserve name casing"}
-
 User: "Замени слово 'проект' на 'программа'"
 Response: {"replacements": {"проект": "программа"}, "case_sensitive": false, "notes": ""}
+"""
+
+_EXTENDED_EXAMPLES = """
+User: "Change John Smith to Jane Doe everywhere"
+Response: {"replacements": {"John Smith": "Jane Doe"}, "case_sensitive": true, "notes": "Using case-sensitive to preserve name casing"}
 
 User: "Update all January dates to March"
 Response: {"replacements": {"January": "March", "Jan": "Mar", "Jan.": "Mar."}, "case_sensitive": false, "notes": "Included common abbreviations of January"}
@@ -54,6 +85,38 @@ User: "Replace Draft with Final in the title only"
 Response: {"replacements": {"Draft": "Final"}, "case_sensitive": true, "notes": "User requested replacement only in titles, but this tool replaces everywhere. Manual review recommended."}
 """
 
+SYSTEM_PROMPT = _CORE_RULES + _FEW_SHOT + (_EXTENDED_EXAMPLES if LLM_VERBOSE_PROMPT else "")
+
+# Sent as the user message of a batched call; the system prefix stays unchanged
+_BATCH_INSTRUCTION = """Parse each instruction below independently, following the rules above.
+Reply with ONLY {"results": [{"id": <id>, "replacements": {...}, "case_sensitive": false, "notes": ""}, ...]},
+one entry per id.
+"""
+
+# Frozen system prefix: byte-identical on every call so the provider-side
+# prompt cache can reuse it; only the trailing user message varies.
+_SYSTEM_MESSAGES = (
+    {
+        "role": "system",
+        "content": [
+            {"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}},
+        ],
+    },
+)
+
+# JSON mode makes the model emit a bare JSON object; cleared at runtime if
+# the upstream rejects it, after which replies go through fence stripping.
+_JSON_RESPONSE_FORMAT = {"type": "json_object"}
+_json_mode = True
+
+# Static part of every chat completion request; only "messages" is filled per call
+_BODY_TEMPLATE: dict[str, Any] = {
+    "model": ROUTELLM_MODEL,
+    "messages": _SYSTEM_MESSAGES,
+    "temperature": 0.0,
+    "max_tokens": 1024,
+}
+
 
 async def parse_prompt(user_prompt: str) -> dict[str, Any]:
     """Parse a natural language editing prompt into structured replacements.
@@ -65,42 +128,280 @@ async def parse_prompt(user_prompt: str) -> dict[str, Any]:
         Dict with keys: replacements (dict[str,str]), case_sensitive (bool), notes (str).
 
     Raises:
-        ValueError: If the LLM response cannot be parsed.
+        ValueError: If the LLM response cannot be parsed or RouteLLM is unreachable.
         httpx.HTTPError: If the API call fails.
     """
+    global _cache_hits
+
     if not ROUTELLM_API_KEY:
         raise ValueError(
             "ROUTELLM_API_KEY is not configured. "
             "Set it in .env or use /api/edit-simple with explicit replacements."
         )
 
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        response = await client.post(
-            f"{ROUTELLM_BASE_URL}/chat/completions",
-            headers={
-                "Authorization": f"Bearer {ROUTELLM_API_KEY}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": ROUTELLM_MODEL,
-                "messages": [
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt},
-                ],
-                "temperature": 0.0,
-                "max_tokens": 1024,
-            },
+    key = (_cache_key(user_prompt), ROUTELLM_MODEL)
+
+    cached = _prompt_cache.get(key)
+    if cached is not None:
+        _prompt_cache.move_to_end(key)
+        _cache_hits += 1
+        logger.info("LLM prompt cache hit (%d hits total)", _cache_hits)
+        return copy.deepcopy(cached)
+
+    # Coalesce concurrent identical prompts into a single upstream call. The
+    # call runs in its own task, so a caller that disconnects (and is
+    # cancelled) does not cancel it for the others waiting on the result.
+    pending = _in_flight.get(key)
+    if pending is None:
+        pending = asyncio.get_running_loop().create_task(_parse_uncached(key, user_prompt))
+        _in_flight[key] = pending
+        pending.add_done_callback(functools.partial(_parse_done, key))
+    return copy.deepcopy(await asyncio.shield(pending))
+
+
+async def _parse_uncached(key: tuple[str, str], user_prompt: str) -> dict[str, Any]:
+    """Parse a prompt missing from the LRU: disk cache first, then the LLM."""
+    disk_key = _disk_key(key)
+    result = await asyncio.to_thread(_disk_get, disk_key)
+    if result is not None:
+        logger.info("LLM prompt disk cache hit")
+    else:
+        cacheable = True
+        if LLM_BATCH_PROMPTS:
+            result, batched = await _submit(user_prompt)
+            # Other prompts in the same call could have steered this
+            # parse, so it is never cached for later callers
+            cacheable = not batched
+        else:
+            result = await _request_parse(user_prompt)
+        if not cacheable:
+            return result
+        await asyncio.to_thread(_disk_set, disk_key, result)
+
+    _prompt_cache[key] = result
+    if len(_prompt_cache) > PROMPT_CACHE_SIZE:
+        _prompt_cache.popitem(last=False)
+    return result
+
+
+def _parse_done(key: tuple[str, str], task: asyncio.Task) -> None:
+    """Forget a finished parse task; its waiters already hold the result."""
+    if _in_flight.get(key) is task:
+        del _in_flight[key]
+    if not task.cancelled():
+        task.exception()  # mark retrieved when every caller has gone
+
+
+def _cache_key(user_prompt: str) -> str:
+    """Canonical form of a prompt for cache lookups (the LLM gets the original).
+
+    Case and compatibility characters are kept: the replacement strings are
+    copied verbatim from the prompt, so only equivalent spellings may collide.
+    """
+    return _WS_RE.sub(" ", unicodedata.normalize("NFC", user_prompt).strip())
+
+
+def clear_prompt_cache() -> None:
+    """Drop all cached prompt parses (in memory and on disk)."""
+    _prompt_cache.clear()
+    with _disk_lock:
+        try:
+            _disk_conn().execute("DELETE FROM prompts")
+        except sqlite3.Error as e:
+            logger.warning("Prompt disk cache clear failed: %s", e)
+
+
+# ---------------------------------------------------------------------------
+# On-disk prompt cache (SQLite)
+# ---------------------------------------------------------------------------
+
+_disk_lock = threading.Lock()
+_disk: sqlite3.Connection | None = None
+
+
+def _disk_conn() -> sqlite3.Connection:
+    """Open the SQLite cache on first use (callers hold ``_disk_lock``)."""
+    global _disk
+    if _disk is None:
+        _disk = sqlite3.connect(str(PROMPT_CACHE_PATH), check_same_thread=False, isolation_level=None)
+        _disk.execute("PRAGMA journal_mode=WAL")
+        _disk.execute(
+            "CREATE TABLE IF NOT EXISTS prompts "
+            "(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
         )
-        response.raise_for_status()
+    return _disk
+
+
+def _disk_key(key: tuple[str, str]) -> str:
+    """Digest of prompt, model and system prompt, so prompt edits invalidate."""
+    raw = "\0".join((*key, SYSTEM_PROMPT)).encode()
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def _disk_get(disk_key: str) -> dict[str, Any] | None:
+    """Return a cached parse, or None if missing, expired or unreadable."""
+    with _disk_lock:
+        try:
+            conn = _disk_conn()
+            row = conn.execute(
+                "SELECT value FROM prompts WHERE key = ? AND expires_at > ?",
+                (disk_key, time.time()),
+            ).fetchone()
+            if row is None:
+                return None
+            try:
+                return orjson.loads(row[0])
+            except orjson.JSONDecodeError as e:
+                # Corrupt or truncated row: drop it so the prompt is re-parsed
+                logger.warning("Prompt disk cache entry unreadable, dropping it: %s", e)
+                conn.execute("DELETE FROM prompts WHERE key = ?", (disk_key,))
+                return None
+        except sqlite3.Error as e:
+            logger.warning("Prompt disk cache read failed: %s", e)
+            return None
+
+
+def _disk_set(disk_key: str, value: dict[str, Any]) -> None:
+    """Store a parse and drop expired rows; failures only cost a future miss."""
+    now = time.time()
+    with _disk_lock:
+        try:
+            conn = _disk_conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO prompts (key, value, expires_at) VALUES (?, ?, ?)",
+                (disk_key, orjson.dumps(value), now + PROMPT_CACHE_TTL_SECONDS),
+            )
+            conn.execute("DELETE FROM prompts WHERE expires_at <= ?", (now,))
+        except sqlite3.Error as e:
+            logger.warning("Prompt disk cache write failed: %s", e)
+
+
+async def _read_capped(response: httpx.Response) -> bytes:
+    """Read a streamed response body, failing fast once it exceeds the cap."""
+    declared = response.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > MAX_RESPONSE_BYTES:
+        raise ValueError(f"LLM response too large ({declared} bytes)")
+
+    body = bytearray()
+    async for chunk in response.aiter_bytes():
+        body += chunk
+        if len(body) > MAX_RESPONSE_BYTES:
+            raise ValueError(f"LLM response exceeded {MAX_RESPONSE_BYTES} bytes")
+    return bytes(body)
+
+
+def _is_retryable(exc: Exception) -> bool:
+    """Transport failures, 429 and 5xx are worth another attempt."""
+    if isinstance(exc, httpx.TransportError):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return False
 
-    data = response.json()
+
+def _retry_delay(exc: Exception, attempt: int) -> float:
+    """Exponential backoff with jitter, honouring ``Retry-After`` if sent."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        retry_after = exc.response.headers.get("retry-after", "")
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    delay = min(RETRY_INITIAL_DELAY * (2 ** attempt), RETRY_MAX_DELAY)
+    return delay + random.uniform(0, RETRY_INITIAL_DELAY)
+
+
+class _UpstreamStatusError(httpx.HTTPStatusError):
+    """``HTTPStatusError`` that also carries the (capped) error body.
+
+    The response is streamed, so ``e.response`` is not readable afterwards.
+    """
+
+    def __init__(self, response: httpx.Response, body: bytes) -> None:
+        super().__init__(
+            f"RouteLLM returned HTTP {response.status_code}",
+            request=response.request,
+            response=response,
+        )
+        self.body = body
+
+
+async def _post_once(client: httpx.AsyncClient, payload: bytes) -> bytes:
+    """POST one serialized chat completion request and return the raw body."""
+    async with client.stream("POST", "/chat/completions", content=payload) as response:
+        if response.is_error:
+            try:
+                body = await _read_capped(response)
+            except ValueError:
+                body = b""
+            raise _UpstreamStatusError(response, body)
+        return await _read_capped(response)
+
+
+def _rejects_json_mode(exc: httpx.HTTPStatusError) -> bool:
+    """Whether a 400 says the upstream does not support ``response_format``.
+
+    Other 400s (oversized prompt, policy rejection, bad body) must not
+    turn JSON mode off for the whole process.
+    """
+    if exc.response.status_code != 400 or not isinstance(exc, _UpstreamStatusError):
+        return False
+    body = exc.body.lower()
+    return b"response_format" in body or b"json_object" in body
+
+
+async def _post_with_retry(payload: bytes) -> bytes:
+    """Call :func:`_post_once`, retrying transient upstream failures."""
+    client = get_routellm_client()
+    for attempt in range(RETRY_ATTEMPTS - 1):
+        try:
+            return await _post_once(client, payload)
+        except (httpx.TransportError, httpx.HTTPStatusError) as e:
+            if not _is_retryable(e):
+                raise
+            delay = _retry_delay(e, attempt)
+            logger.warning(
+                "RouteLLM request failed (%s), retrying in %.2fs (attempt %d/%d)",
+                type(e).__name__, delay, attempt + 1, RETRY_ATTEMPTS,
+            )
+            await asyncio.sleep(delay)
+    return await _post_once(client, payload)
+
+
+async def _complete(user_content: str, max_tokens: int) -> Any:
+    """Send one user message after the system prefix and decode the JSON reply."""
+    global _json_mode
+
+    request = dict(_BODY_TEMPLATE)
+    request["messages"] = (*_SYSTEM_MESSAGES, {"role": "user", "content": user_content})
+    request["max_tokens"] = max_tokens
+    json_mode = _json_mode
+    if json_mode:
+        request["response_format"] = _JSON_RESPONSE_FORMAT
+    try:
+        try:
+            body = await _post_with_retry(orjson.dumps(request))
+        except httpx.HTTPStatusError as e:
+            if not json_mode or not _rejects_json_mode(e):
+                raise
+            # Upstream rejected response_format: disable it for this process
+            logger.warning("RouteLLM rejected response_format, falling back to fence stripping")
+            _json_mode = json_mode = False
+            del request["response_format"]
+            body = await _post_with_retry(orjson.dumps(request))
+    except httpx.ConnectTimeout as e:
+        raise ValueError("RouteLLM unreachable (connect timed out)") from e
+
+    data = orjson.loads(body)
 
     # Log token usage
     usage = data.get("usage", {})
     if usage:
         logger.info(
-            "LLM usage — prompt: %d tokens, completion: %d tokens, total: %d tokens, model: %s",
+            "LLM usage — prompt: %d tokens (cached: %d), completion: %d tokens, total: %d tokens, model: %s",
             usage.get("prompt_tokens", 0),
+            usage.get("cache_read_input_tokens", 0),
             usage.get("completion_tokens", 0),
             usage.get("total_tokens", 0),
             data.get("model", "unknown"),
@@ -108,25 +409,142 @@ async def parse_prompt(user_prompt: str) -> dict[str, Any]:
 
     content = data["choices"][0]["message"]["content"].strip()
 
-    # Strip markdown code fences if present
-    if content.startswith("```"):
-        lines = content.split("\n")
-        # Remove first and last lines (fences)
-        lines = [l for l in lines if not l.strip().startswith("```")]
-        content = "\n".join(lines)
+    # Without JSON mode (or if a proxy drops it) the reply may be fenced
+    if not json_mode or content.startswith("```"):
+        content = _FENCE_RE.sub("", content)
 
     try:
-        parsed = json.loads(content)
-    except json.JSONDecodeError as e:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError as e:
         logger.error("Failed to parse LLM response: %s\nContent: %s", e, content)
         raise ValueError(f"LLM returned invalid JSON: {content[:200]}")
 
-    # Validate structure
-    if "replacements" not in parsed or not isinstance(parsed["replacements"], dict):
+
+def _validate(parsed: Any) -> dict[str, Any]:
+    """Check the parsed reply shape and fill in optional keys in place."""
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("replacements"), dict):
         raise ValueError("LLM response missing 'replacements' dict")
 
-    return {
-        "replacements": parsed["replacements"],
-        "case_sensitive": parsed.get("case_sensitive", False),
-        "notes": parsed.get("notes", ""),
-    }
+    parsed.setdefault("case_sensitive", False)
+    parsed.setdefault("notes", "")
+    return parsed
+
+
+async def _request_parse(user_prompt: str) -> dict[str, Any]:
+    """Send *user_prompt* to the LLM and validate the structured reply."""
+    return _validate(await _complete(user_prompt, 1024))
+
+
+async def _request_batch(prompts: list[str]) -> list[dict[str, Any] | None]:
+    """Parse several prompts in one LLM call.
+
+    Returns one entry per prompt, in order; ``None`` where the reply had
+    no usable result for that prompt.
+    """
+    user_content = _BATCH_INSTRUCTION + orjson.dumps(
+        {"prompts": [{"id": i, "text": p} for i, p in enumerate(prompts)]}
+    ).decode()
+    parsed = await _complete(user_content, 1024 * len(prompts))
+
+    by_id: dict[Any, Any] = {}
+    if isinstance(parsed, dict) and isinstance(parsed.get("results"), list):
+        by_id = {r.pop("id", None): r for r in parsed["results"] if isinstance(r, dict)}
+
+    results: list[dict[str, Any] | None] = []
+    for i in range(len(prompts)):
+        try:
+            results.append(_validate(by_id.get(i)))
+        except ValueError:
+            results.append(None)
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Micro-batching: prompts that arrive together share one LLM call. Opt-in
+# (LLM_BATCH_PROMPTS): the prompts of unrelated users share one context.
+# ---------------------------------------------------------------------------
+
+_batch_queue: asyncio.Queue | None = None
+_batch_worker: asyncio.Task | None = None
+_batch_tasks: set[asyncio.Task] = set()
+
+
+async def _submit(user_prompt: str) -> tuple[dict[str, Any], bool]:
+    """Queue *user_prompt* for the batcher and wait for its parse.
+
+    Returns:
+        Tuple of (parse, whether it came from a multi-prompt call).
+    """
+    global _batch_queue, _batch_worker
+
+    loop = asyncio.get_running_loop()
+    if _batch_worker is None or _batch_worker.done() or _batch_worker.get_loop() is not loop:
+        _batch_queue = asyncio.Queue()
+        _batch_worker = loop.create_task(_run_batcher(_batch_queue))
+
+    future: asyncio.Future = loop.create_future()
+    assert _batch_queue is not None
+    _batch_queue.put_nowait((user_prompt, future))
+    return await future
+
+
+async def _run_batcher(queue: asyncio.Queue) -> None:
+    """Collect queued prompts into batches and dispatch them."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+
+        # Let same-tick arrivals enqueue; a lone prompt is sent immediately
+        await asyncio.sleep(0)
+        if not queue.empty():
+            deadline = loop.time() + BATCH_WINDOW_SECONDS
+            while len(batch) < BATCH_MAX_PROMPTS:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+        task = loop.create_task(_dispatch(batch))
+        _batch_tasks.add(task)
+        task.add_done_callback(_batch_tasks.discard)
+
+
+async def _dispatch(batch: list[tuple[str, asyncio.Future]]) -> None:
+    """Resolve each waiting future from a batched call, or singly on fallback."""
+    results: list[dict[str, Any] | None] = [None] * len(batch)
+    if len(batch) > 1:
+        try:
+            results = await _request_batch([prompt for prompt, _ in batch])
+            logger.info("LLM batch of %d prompts parsed in one call", len(batch))
+        except Exception as e:
+            logger.warning("LLM batch of %d failed, falling back to single calls: %s", len(batch), e)
+
+    async def resolve(prompt: str, future: asyncio.Future, result: dict[str, Any] | None) -> None:
+        if future.done():
+            return
+        batched = result is not None
+        try:
+            if result is None:
+                result = await _request_parse(prompt)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result((result, batched))
+
+    await asyncio.gather(*(
+        resolve(prompt, future, result)
+        for (prompt, future), result in zip(batch, results)
+    ))
+
+
+async def stop_batcher() -> None:
+    """Cancel the batch worker (called on application shutdown)."""
+    global _batch_worker
+    if _batch_worker is not None and not _batch_worker.done():
+        _batch_worker.cancel()
+    _batch_worker = None
@@ -1,38 +1,56 @@
-"""FastAPI application for PDF Text Editor."""
+"""FastAPI application for PDF Text Editor.
+
+CPU-bound work must not run on the event-loop thread: document editing,
+saving and preview rendering run in worker processes, so one large
+upload never stalls other requests.
+"""
 
 import asyncio
 import base64
-import json
+import hashlib
 import logging
+import multiprocessing
+import os
+import shutil
 import time
-import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from contextlib import asynccontextmanager
-from io import BytesIO
+from dataclasses import dataclass
 from pathlib import Path
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator, BinaryIO, Callable
 
-import fitz  # PyMuPDF
+import orjson
 from fastapi import FastAPI, File, Form, HTTPException, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
+from fastapi.responses import FileResponse, HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-from PIL import Image
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import Receive, Scope, Send
 
 from config import (
     APP_BASE_URL,
     BASE_DIR,
     CLEANUP_INTERVAL_MINUTES,
     HOST,
+    MAX_CONCURRENT_EDITS,
     MAX_FILE_SIZE_BYTES,
     OUTPUT_DIR,
     PORT,
     UPLOAD_DIR,
+    WORKER_PROCESSES,
+    ensure_dirs,
 )
+from edit_worker import edit_and_save, warm_up as edit_worker_warm_up
+from http_clients import close_clients
+from llm_parser import parse_prompt, stop_batcher
 from payment import (
     PAYMENT_PRICE_USD,
     check_onchain_paid,
     cleanup_expired_payments,
     create_invoice,
+    forget_payment,
     generate_download_token,
     is_paid,
     mark_paid,
@@ -41,9 +59,9 @@ from payment import (
     verify_download_token,
     verify_webhook_signature,
 )
-from pdf_editor import ReplacementResult, replace_text
+from pdf_editor import ReplacementResult
+from preview_renderer import render_preview
 from qrcode_gen import generate_payment_qr
-from watermark import add_watermark
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(
@@ -54,38 +72,143 @@ logging.basicConfig(
 # Increase cleanup to 2 hours (give time for payment)
 CLEANUP_SECONDS = max(CLEANUP_INTERVAL_MINUTES, 120) * 60
 
+# result_file_id -> saved result path; filled by _save_result, pruned by cleanup
+RESULT_EXTENSIONS = ("pdf", "jpg", "png")
+_result_index: dict[str, Path] = {}
+
+# Uploads are copied to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Edits beyond this many queue instead of competing for CPU and memory
+_edit_semaphore = asyncio.Semaphore(MAX_CONCURRENT_EDITS)
+_edits_waiting = 0
+_edits_in_progress = 0
+
+# Recent edits by content hash + options, for reusing identical requests
+EDIT_CACHE_SIZE = 256
+_edit_cache: "OrderedDict[str, EditOutcome]" = OrderedDict()
+
+# Rasterisation resolution for jpg/png results (client may override)
+RENDER_DPI_DEFAULT = 150
+RENDER_DPI_MIN = 72
+RENDER_DPI_MAX = 300
+
+# Worker processes for editing and preview rendering, created on first use
+_worker_executor: ProcessPoolExecutor | None = None
+
+
+# Files deleted per cleanup batch, split across this many worker threads
+CLEANUP_BATCH_SIZE = 100
+CLEANUP_PARALLELISM = 4
+
+
+def _scan_expired(directory: Path, cutoff: float) -> tuple[list[str], float | None]:
+    """Return files in ``directory`` last modified before ``cutoff``.
+
+    ``os.scandir`` entries carry cached stat data, so this costs one
+    directory read rather than a ``stat`` call per file. Also returns the
+    oldest mtime among the files kept (None if there are none), so the
+    caller knows when the next file falls due.
+    """
+    expired: list[str] = []
+    oldest_kept: float | None = None
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name == ".gitkeep":
+                    continue
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    mtime = entry.stat(follow_symlinks=False).st_mtime
+                except OSError as e:
+                    logger.warning("Failed to stat %s: %s", entry.name, e)
+                    continue
+                if mtime < cutoff:
+                    expired.append(entry.path)
+                elif oldest_kept is None or mtime < oldest_kept:
+                    oldest_kept = mtime
+    except OSError as e:
+        logger.warning("Failed to scan %s: %s", directory, e)
+    return expired, oldest_kept
+
+
+def _delete_files(paths: list[str]) -> list[str]:
+    """Unlink ``paths`` and return the file names actually removed."""
+    removed: list[str] = []
+    for path in paths:
+        name = os.path.basename(path)
+        try:
+            os.unlink(path)
+            removed.append(name)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Failed to clean up %s: %s", name, e)
+    return removed
+
 
 async def _cleanup_old_files() -> None:
-    """Periodically delete files older than CLEANUP_SECONDS."""
+    """Periodically delete files older than CLEANUP_SECONDS.
+
+    Directory scans and unlinks run in worker threads, each batch split
+    across CLEANUP_PARALLELISM threads so slow-metadata filesystems do not
+    serialise the deletes; the event loop never blocks. After each pass
+    the task sleeps until the oldest remaining file is due, capped at
+    ``min(CLEANUP_SECONDS, 600)``. Payment state for deleted results and
+    expired on-chain requests is dropped in the same pass.
+    """
+    interval = min(CLEANUP_SECONDS, 600)
+    delay = interval
     while True:
-        await asyncio.sleep(CLEANUP_SECONDS)
+        await asyncio.sleep(delay)
         now = time.time()
         cutoff = now - CLEANUP_SECONDS
+        next_due: float | None = None
         for directory in (UPLOAD_DIR, OUTPUT_DIR):
-            for f in directory.iterdir():
-                if f.name == ".gitkeep":
-                    continue
-                try:
-                    if f.stat().st_mtime < cutoff:
-                        f.unlink()
-                        logger.info("Cleaned up old file: %s", f.name)
-                except OSError as e:
-                    logger.warning("Failed to clean up %s: %s", f.name, e)
+            expired, oldest_kept = await asyncio.to_thread(_scan_expired, directory, cutoff)
+            if oldest_kept is not None:
+                due = oldest_kept + CLEANUP_SECONDS
+                next_due = due if next_due is None else min(next_due, due)
+            for i in range(0, len(expired), CLEANUP_BATCH_SIZE):
+                batch = expired[i:i + CLEANUP_BATCH_SIZE]
+                parts = [batch[j::CLEANUP_PARALLELISM] for j in range(CLEANUP_PARALLELISM)]
+                removed_parts = await asyncio.gather(
+                    *(asyncio.to_thread(_delete_files, part) for part in parts if part)
+                )
+                for removed in removed_parts:
+                    for name in removed:
+                        stem = os.path.splitext(name)[0]
+                        _result_index.pop(stem, None)
+                        if "_" not in stem:  # a result, not one of its previews
+                            forget_payment(stem)
+                        logger.info("Cleaned up old file: %s", name)
+        cleanup_expired_payments()
+        delay = interval if next_due is None else min(interval, max(1.0, next_due - time.time()))
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
-    """Manage application lifecycle: start cleanup task."""
+    """Manage application lifecycle: warm up, start workers and cleanup, close HTTP clients."""
+    ensure_dirs()
+    indexed = await asyncio.to_thread(_rebuild_result_index)
+    logger.info("Indexed %d existing result files", indexed)
+    _start_workers()
     task = asyncio.create_task(_cleanup_old_files())
     yield
     task.cancel()
 
+    await stop_batcher()
+    await close_clients()
+    _shutdown_workers()
+
 
 app = FastAPI(
     title="PDF Text Editor",
     description="AI-powered find & replace for PDF files",
     version="1.1.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -96,88 +219,399 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Serve frontend static files
-FRONTEND_DIR = BASE_DIR / "frontend"
-if FRONTEND_DIR.exists():
-    app.mount("/static", StaticFiles(directory=str(FRONTEND_DIR)), name="static")
+# Previews (JPEG) and downloads (deflated PDF / JPEG / PNG) are already
+# compressed; gzipping them again only burns CPU and drops Content-Length.
+GZIP_SKIP_PREFIXES = ("/api/preview/", "/api/download/")
+
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that passes already-compressed binary routes through."""
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and scope["path"].startswith(GZIP_SKIP_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
 
 
+# Added after CORS so it wraps it and compresses the final response
+app.add_middleware(SelectiveGZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
 
-def _format_results(results: list[ReplacementResult]) -> list[dict]:
-    """Convert replacement results to JSON-serializable dicts."""
-    return [
-        {"original": r.original, "replacement": r.replacement, "count": r.count}
-        for r in results
-    ]
+def _new_id() -> str:
+    """Return a random 128-bit identifier as 26 lowercase base32 characters.
+
+    Shorter than hex in every path and URL, and like hex it never contains
+    ``_``, which separates a result id from its preview suffix.
+    """
+    return base64.b32encode(os.urandom(16)).rstrip(b"=").decode("ascii").lower()
+
+
+def _format_results(results: list[ReplacementResult]) -> tuple[list[dict], int]:
+    """Convert replacement results to JSON-serializable dicts, in one pass.
+
+    Returns:
+        Tuple of (report entries, total number of replacements).
+    """
+    report: list[dict] = []
+    total = 0
+    for r in results:
+        report.append({"original": r.original, "replacement": r.replacement, "count": r.count})
+        total += r.count
+    return report, total
+
+
+def _find_result(result_file_id: str) -> Path | None:
+    """Return the saved result file for *result_file_id*, or None if gone.
+
+    Checks the in-memory index first, then probes the three possible
+    extensions (covers files saved before a restart or by another worker).
+    """
+    path = _result_index.get(result_file_id)
+    if path is not None:
+        return path
+    for ext in RESULT_EXTENSIONS:
+        path = OUTPUT_DIR / f"{result_file_id}.{ext}"
+        if path.is_file():
+            _result_index[result_file_id] = path
+            return path
+    return None
+
+
+def _rebuild_result_index() -> int:
+    """Index the result files already in OUTPUT_DIR (used at startup).
+
+    Previews (``<id>_p<n>.jpg``) and temp files are skipped. Returns the
+    number of results indexed.
+    """
+    found: dict[str, Path] = {}
+    with os.scandir(OUTPUT_DIR) as it:
+        for entry in it:
+            stem, _, ext = entry.name.partition(".")
+            if ext in RESULT_EXTENSIONS and "_" not in stem and entry.is_file():
+                found[stem] = Path(entry.path)
+    _result_index.update(found)
+    return len(found)
+
+
+def _preview_path(result_file_id: str, page_index: int) -> Path:
+    """Location of the watermarked JPEG preview for one result page."""
+    return OUTPUT_DIR / f"{result_file_id}_p{page_index}.jpg"
+
+
+def _get_worker_executor() -> ProcessPoolExecutor:
+    """Return the worker process pool, creating it on first use.
+
+    Editing, saving and preview rendering all run here: MuPDF holds the
+    GIL and is not thread-safe, so separate processes are what let one
+    large document proceed without stalling the loop or other requests.
+    The pool is kept between requests, so workers keep MuPDF loaded;
+    each one runs ``edit_worker.warm_up`` once when it starts. If a worker
+    dies the pool is broken for good, so ``_run_in_worker`` drops it and
+    the next call creates a fresh one. Workers are spawned rather than forked: the server process has
+    running threads, and a forked child could inherit a held lock.
+    """
+    global _worker_executor
+    if _worker_executor is None:
+        _worker_executor = ProcessPoolExecutor(
+            max_workers=WORKER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=edit_worker_warm_up,
+        )
+    return _worker_executor
+
+
+def _start_workers() -> None:
+    """Spawn all worker processes now so no request waits for a cold one."""
+    executor = _get_worker_executor()
+    # One no-op job per worker makes the pool spawn (and warm) all of them
+    for _ in range(WORKER_PROCESSES):
+        executor.submit(int)
+
 
+def _shutdown_workers() -> None:
+    """Stop the worker processes (called on application shutdown)."""
+    global _worker_executor
+    if _worker_executor is not None:
+        _worker_executor.shutdown(wait=False, cancel_futures=True)
+        _worker_executor = None
 
-def _pdf_bytes_to_preview(pdf_bytes: bytes, dpi: int = 150) -> list[str]:
-    """Render PDF pages as JPEG images with watermark, return as base64 strings."""
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    previews: list[str] = []
+
+async def _run_in_worker(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run ``fn(*args)`` in the process pool without blocking the loop.
+
+    Raises:
+        HTTPException: 503 if a worker process died (e.g. MuPDF crashed on
+            a malformed document or the worker was OOM-killed). The job is
+            not retried: the same input would likely bring down the new
+            pool as well.
+    """
+    global _worker_executor
+    executor = _get_worker_executor()
     try:
-        for page in doc:
-            pix = page.get_pixmap(dpi=dpi)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            img = add_watermark(img)
-            buf = BytesIO()
-            img.save(buf, format="JPEG", quality=80)
-            previews.append(base64.b64encode(buf.getvalue()).decode())
-    finally:
-        doc.close()
-    return previews
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    except BrokenProcessPool:
+        # Another failed call may already have replaced the pool
+        if _worker_executor is executor:
+            logger.error("Worker process died; replacing the process pool")
+            executor.shutdown(wait=False, cancel_futures=True)
+            _worker_executor = None
+        raise HTTPException(
+            status_code=503,
+            detail="Document processing worker crashed. Please try again.",
+        )
 
 
-def _save_result(pdf_bytes: bytes, file_id: str, output_format: str, original_filename: str) -> Path:
-    """Convert result to requested format and save to OUTPUT_DIR.
+async def _render_in_worker(source: str | bytes, page_index: int, out_path: Path) -> bool:
+    """Render one preview page in the process pool without blocking the loop."""
+    return await _run_in_worker(render_preview, source, page_index, str(out_path))
 
-    Returns path to the saved file.
+
+async def _render_previews(result_file_id: str, result_path: Path, page_count: int) -> list[str]:
+    """Render the first page preview now; return URLs for every page.
+
+    Previews are rendered from the saved result: a PDF, or for single-page
+    image output the already-rasterised image, so that page is not run
+    through MuPDF's vector renderer twice. The remaining pages are
+    rendered lazily by ``GET /api/preview``, so response latency no longer
+    grows with page count. Concurrent preview requests fan out across the
+    worker processes.
     """
-    if output_format == "pdf":
-        out_path = OUTPUT_DIR / f"{file_id}.pdf"
-        out_path.write_bytes(pdf_bytes)
-        return out_path
+    first = _preview_path(result_file_id, 0)
+    if not first.is_file():
+        await _render_in_worker(str(result_path), 0, first)
+    return [f"/api/preview/{result_file_id}/{i}" for i in range(page_count)]
+
 
-    # Image formats
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+def _clamp_dpi(dpi: int) -> int:
+    """Keep a client-supplied render DPI within the supported range."""
+    return max(RENDER_DPI_MIN, min(RENDER_DPI_MAX, dpi))
+
+
+def _file_too_large() -> HTTPException:
+    """413 error for uploads over MAX_FILE_SIZE_BYTES."""
+    return HTTPException(
+        status_code=413,
+        detail=f"File too large. Max {MAX_FILE_SIZE_BYTES // (1024*1024)}MB",
+    )
+
+
+def _check_upload_size(file: UploadFile) -> None:
+    """Reject an upload the multipart parser already knows is too large.
+
+    Raises:
+        HTTPException: 413 if the declared size exceeds MAX_FILE_SIZE_BYTES.
+    """
+    if file.size is not None and file.size > MAX_FILE_SIZE_BYTES:
+        raise _file_too_large()
+
+
+def _copy_upload(src: BinaryIO, dst: Path) -> str:
+    """Copy the spooled upload to *dst* in chunks, enforcing the size limit.
+
+    Returns the SHA-256 hex digest of the content, computed in the same pass.
+    """
+    size = 0
+    digest = hashlib.sha256()
+    with open(dst, "wb") as out:
+        while chunk := src.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > MAX_FILE_SIZE_BYTES:
+                raise _file_too_large()
+            digest.update(chunk)
+            out.write(chunk)
+    return digest.hexdigest()
+
+
+async def _save_upload(file: UploadFile) -> tuple[Path, str]:
+    """Stream an uploaded PDF to UPLOAD_DIR in chunks, enforcing the size limit.
+
+    Only one chunk is held in memory at a time, and the whole copy runs in
+    a single worker-thread hop rather than one per chunk. The data is
+    written to a temporary name and renamed into place, so a crash never
+    leaves a truncated upload behind.
+
+    Returns:
+        Tuple of (saved path, SHA-256 hex digest of the content).
+    """
+    # The multipart parser already knows the size; reject without copying
+    _check_upload_size(file)
+
+    upload_path = UPLOAD_DIR / f"{_new_id()}.pdf"
+    tmp_path = upload_path.with_name(f"{upload_path.name}.tmp")
     try:
-        if len(doc) == 1:
-            pix = doc[0].get_pixmap(dpi=200)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            ext = output_format
-            out_path = OUTPUT_DIR / f"{file_id}.{ext}"
-            if output_format == "jpg":
-                img.save(str(out_path), format="JPEG", quality=95)
-            else:
-                img.save(str(out_path), format="PNG")
-            return out_path
-        else:
-            # Multi-page: save as PDF regardless (user gets all pages)
-            out_path = OUTPUT_DIR / f"{file_id}.pdf"
-            out_path.write_bytes(pdf_bytes)
-            return out_path
-    finally:
-        doc.close()
+        await file.seek(0)
+        content_hash = await asyncio.to_thread(_copy_upload, file.file, tmp_path)
+        os.replace(tmp_path, upload_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return upload_path, content_hash
+
+
+@dataclass
+class EditOutcome:
+    """Saved result of one edit, ready for preview rendering."""
+
+    result_file_id: str
+    result_path: Path
+    page_count: int
+    results: list[ReplacementResult]
 
 
-def _process_pdf(
+async def _edit_in_worker(
     upload_path: Path,
     repl_dict: dict[str, str],
     case_sensitive: bool,
-) -> tuple[bytes, list[ReplacementResult]]:
-    """Run replacement with PyMuPDF, fallback to raster if needed."""
+    output_format: str,
+    dpi: int,
+) -> EditOutcome:
+    """Edit the upload and save the clean result in the process pool.
+
+    Raises:
+        HTTPException: 503 if the worker died while editing (see
+            ``_run_in_worker``); the pool is replaced for later requests.
+    """
+    result_file_id = _new_id()
+    result_path, page_count, results = await _run_in_worker(
+        edit_and_save,
+        str(upload_path), repl_dict, case_sensitive,
+        str(OUTPUT_DIR / result_file_id), output_format, dpi,
+    )
+    result_path = Path(result_path)
+    _result_index[result_file_id] = result_path
+    return EditOutcome(result_file_id, result_path, page_count, results)
+
+
+def _edit_cache_key(
+    content_hash: str,
+    repl_dict: dict[str, str],
+    case_sensitive: bool,
+    output_format: str,
+    dpi: int,
+) -> str:
+    """Identify an edit by its input content and every option that shapes the result."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(content_hash.encode())
+    h.update(orjson.dumps(repl_dict, option=orjson.OPT_SORT_KEYS))
+    h.update(f"|{case_sensitive}|{output_format}|{dpi}".encode())
+    return h.hexdigest()
+
+
+def _clone_cached_edit(cached: EditOutcome) -> EditOutcome | None:
+    """Publish a cached result under a fresh id, or None if it has expired.
+
+    Every request still gets its own ``result_file_id`` so payment state is
+    never shared between two uploads of the same file. Existing previews
+    are copied as well. Copies rather than hard links: a link shares the
+    inode and so the mtime that cleanup ages files by, and every reuse
+    would keep the older result alive too.
+    """
+    result_file_id = _new_id()
+    result_path = OUTPUT_DIR / f"{result_file_id}{cached.result_path.suffix}"
     try:
-        return replace_text(str(upload_path), repl_dict, case_sensitive)
-    except Exception as e:
-        logger.error("PyMuPDF method failed: %s", e)
+        shutil.copyfile(cached.result_path, result_path)
+    except FileNotFoundError:
+        return None
+    for i in range(cached.page_count):
         try:
-            from pdf_editor_raster import replace_text_raster
-            return replace_text_raster(str(upload_path), repl_dict)
-        except ImportError:
-            raise HTTPException(status_code=500, detail=f"PDF processing failed: {e}")
+            shutil.copyfile(_preview_path(cached.result_file_id, i), _preview_path(result_file_id, i))
+        except FileNotFoundError:
+            pass
+    _result_index[result_file_id] = result_path
+    return EditOutcome(result_file_id, result_path, cached.page_count, cached.results)
+
+
+async def _run_edit(
+    file: UploadFile,
+    repl_dict: dict[str, str],
+    case_sensitive: bool,
+    output_format: str,
+    render_dpi: int,
+    extra_response: dict | None = None,
+) -> ORJSONResponse:
+    """Run ``_run_edit_unbounded`` with at most MAX_CONCURRENT_EDITS at once."""
+    global _edits_waiting, _edits_in_progress
+    _edits_waiting += 1
+    try:
+        await _edit_semaphore.acquire()
+    finally:
+        _edits_waiting -= 1
+    _edits_in_progress += 1
+    try:
+        return await _run_edit_unbounded(
+            file, repl_dict, case_sensitive, output_format, render_dpi, extra_response,
+        )
+    finally:
+        _edits_in_progress -= 1
+        _edit_semaphore.release()
+
+
+async def _run_edit_unbounded(
+    file: UploadFile,
+    repl_dict: dict[str, str],
+    case_sensitive: bool,
+    output_format: str,
+    render_dpi: int,
+    extra_response: dict | None = None,
+) -> ORJSONResponse:
+    """Shared body of the edit endpoints, after their own input handling.
+
+    Saves the upload, edits and saves the clean result off the event loop,
+    renders the first watermarked preview and builds the JSON response;
+    *extra_response* is merged into it. An identical earlier edit (same
+    content hash and options) is reused instead of reprocessed. The upload
+    is always removed.
+    """
+    upload_path, content_hash = await _save_upload(file)
+    dpi = _clamp_dpi(render_dpi)
+    cache_key = _edit_cache_key(content_hash, repl_dict, case_sensitive, output_format, dpi)
+
+    try:
+        outcome = None
+        cached = _edit_cache.get(cache_key)
+        if cached is not None:
+            outcome = await asyncio.to_thread(_clone_cached_edit, cached)
+            if outcome is None:
+                _edit_cache.pop(cache_key, None)
+            else:
+                _edit_cache.move_to_end(cache_key)
+                logger.info("Reused edit result %s for %s", cached.result_file_id, outcome.result_file_id)
+
+        if outcome is None:
+            # Save clean result for later download and generate watermarked preview
+            outcome = await _edit_in_worker(upload_path, repl_dict, case_sensitive, output_format, dpi)
+            _edit_cache[cache_key] = outcome
+            if len(_edit_cache) > EDIT_CACHE_SIZE:
+                _edit_cache.popitem(last=False)
+
+        previews = await _render_previews(outcome.result_file_id, outcome.result_path, outcome.page_count)
+        report, total_replacements = _format_results(outcome.results)
+
+        body = {
+            "preview_urls": previews,
+            "result_file_id": outcome.result_file_id,
+            "output_format": output_format,
+            "original_filename": file.filename,
+            "replacements_report": report,
+            "total_replacements": total_replacements,
+            "total_pages": len(previews),
+            "price_usd": PAYMENT_PRICE_USD,
+        }
+        if extra_response:
+            body.update(extra_response)
+        return ORJSONResponse(body)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Unexpected error during PDF editing")
+        raise HTTPException(status_code=500, detail=f"Processing error: {e}")
+    finally:
+        upload_path.unlink(missing_ok=True)
 
 
 # ---------------------------------------------------------------------------
@@ -190,13 +624,24 @@ async def health() -> dict:
     return {"status": "ok", "service": "pdf-text-editor"}
 
 
+@app.get("/api/metrics")
+async def metrics() -> dict:
+    """Edit concurrency gauges, for tuning MAX_CONCURRENT_EDITS."""
+    return {
+        "edits_in_progress": _edits_in_progress,
+        "edits_waiting": _edits_waiting,
+        "max_concurrent_edits": MAX_CONCURRENT_EDITS,
+    }
+
+
 @app.post("/api/edit-simple")
 async def edit_simple(
     file: UploadFile = File(...),
     replacements: str = Form(...),
     case_sensitive: bool = Form(True),
     output_format: str = Form("pdf"),
-) -> JSONResponse:
+    render_dpi: int = Form(RENDER_DPI_DEFAULT),
+) -> ORJSONResponse:
     """Edit PDF with explicit replacements (no LLM).
 
     Returns JSON with watermarked preview images and a result_file_id
@@ -205,13 +650,9 @@ async def edit_simple(
     if not file.filename or not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are accepted")
 
-    content = await file.read()
-    if len(content) > MAX_FILE_SIZE_BYTES:
-        raise HTTPException(status_code=413, detail=f"File too large. Max {MAX_FILE_SIZE_BYTES // (1024*1024)}MB")
-
     try:
-        repl_dict: dict[str, str] = json.loads(replacements)
-    except json.JSONDecodeError:
+        repl_dict: dict[str, str] = orjson.loads(replacements)
+    except orjson.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON in replacements field")
     if not isinstance(repl_dict, dict):
         raise HTTPException(status_code=400, detail="Replacements must be a JSON object")
@@ -220,39 +661,7 @@ async def edit_simple(
     if output_format not in ("pdf", "jpg", "png"):
         raise HTTPException(status_code=400, detail="output_format must be pdf, jpg, or png")
 
-    file_id = uuid.uuid4().hex
-    upload_path = UPLOAD_DIR / f"{file_id}.pdf"
-    upload_path.write_bytes(content)
-
-    try:
-        pdf_bytes, results = _process_pdf(upload_path, repl_dict, case_sensitive)
-        total_replacements = sum(r.count for r in results)
-
-        # Generate watermarked preview
-        previews = _pdf_bytes_to_preview(pdf_bytes)
-
-        # Save clean result for later download
-        result_file_id = uuid.uuid4().hex
-        _save_result(pdf_bytes, result_file_id, output_format, file.filename or "doc.pdf")
-
-        return JSONResponse({
-            "preview_images": previews,
-            "result_file_id": result_file_id,
-            "output_format": output_format,
-            "original_filename": file.filename,
-            "replacements_report": _format_results(results),
-            "total_replacements": total_replacements,
-            "total_pages": len(previews),
-            "price_usd": PAYMENT_PRICE_USD,
-        })
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.exception("Unexpected error during PDF editing")
-        raise HTTPException(status_code=500, detail=f"Processing error: {e}")
-    finally:
-        upload_path.unlink(missing_ok=True)
+    return await _run_edit(file, repl_dict, case_sensitive, output_format, render_dpi)
 
 
 @app.post("/api/edit")
@@ -260,19 +669,21 @@ async def edit_with_llm(
     file: UploadFile = File(...),
     prompt: str = Form(...),
     output_format: str = Form("pdf"),
-) -> JSONResponse:
+    render_dpi: int = Form(RENDER_DPI_DEFAULT),
+) -> ORJSONResponse:
     """Edit PDF using natural language instructions parsed by LLM.
 
-    Returns JSON with watermarked preview and result_file_id.
+    The request is validated first (file type, declared size, prompt), so
+    an unusable upload never costs an LLM call. The prompt is then parsed
+    before the upload is written, so a failed parse leaves nothing on
+    disk; the streaming size cap still applies while writing. Returns
+    JSON with watermarked preview and result_file_id.
     """
-    from llm_parser import parse_prompt
-
     if not file.filename or not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are accepted")
 
-    content = await file.read()
-    if len(content) > MAX_FILE_SIZE_BYTES:
-        raise HTTPException(status_code=413, detail=f"File too large. Max {MAX_FILE_SIZE_BYTES // (1024*1024)}MB")
+    # Check the size before the (paid) LLM call, not only when saving
+    _check_upload_size(file)
 
     if not prompt.strip():
         raise HTTPException(status_code=400, detail="Prompt cannot be empty")
@@ -298,78 +709,89 @@ async def edit_with_llm(
             detail="Could not extract any replacements from your instructions. Please be more specific.",
         )
 
-    file_id = uuid.uuid4().hex
-    upload_path = UPLOAD_DIR / f"{file_id}.pdf"
-    upload_path.write_bytes(content)
-
-    try:
-        pdf_bytes, results = _process_pdf(upload_path, repl_dict, case_sensitive)
-        total_replacements = sum(r.count for r in results)
-
-        previews = _pdf_bytes_to_preview(pdf_bytes)
-
-        result_file_id = uuid.uuid4().hex
-        _save_result(pdf_bytes, result_file_id, output_format, file.filename or "doc.pdf")
-
-        return JSONResponse({
-            "preview_images": previews,
-            "result_file_id": result_file_id,
-            "output_format": output_format,
-            "original_filename": file.filename,
-            "replacements_report": _format_results(results),
-            "total_replacements": total_replacements,
-            "total_pages": len(previews),
-            "price_usd": PAYMENT_PRICE_USD,
+    return await _run_edit(
+        file, repl_dict, case_sensitive, output_format, render_dpi,
+        extra_response={
             "parsed_instructions": {
                 "replacements": repl_dict,
                 "case_sensitive": case_sensitive,
                 "notes": notes,
             },
-        })
+        },
+    )
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.exception("Unexpected error during PDF editing")
-        raise HTTPException(status_code=500, detail=f"Processing error: {e}")
-    finally:
-        upload_path.unlink(missing_ok=True)
+
+@app.get("/api/preview/{result_file_id}/{page}")
+async def get_preview(result_file_id: str, page: int) -> FileResponse:
+    """Serve one watermarked preview page, rendering it on first request.
+
+    Cacheable; FileResponse sets an ETag from the file's mtime and size.
+    """
+    if page < 0:
+        raise HTTPException(status_code=404, detail="Preview not found or expired")
+
+    preview_path = _preview_path(result_file_id, page)
+    if not preview_path.is_file():
+        result_path = _find_result(result_file_id)
+        rendered = result_path is not None and await _render_in_worker(str(result_path), page, preview_path)
+        if not rendered:
+            raise HTTPException(status_code=404, detail="Preview not found or expired")
+
+    return FileResponse(
+        path=str(preview_path),
+        media_type="image/jpeg",
+        headers={"Cache-Control": "public, max-age=3600"},
+    )
 
 
 @app.post("/api/create-invoice/{result_file_id}")
-async def create_invoice_endpoint(result_file_id: str) -> JSONResponse:
+async def create_invoice_endpoint(result_file_id: str) -> ORJSONResponse:
     """Create a CryptoBot payment invoice for a result file."""
-    found = list(OUTPUT_DIR.glob(f"{result_file_id}.*"))
-    if not found:
+    if _find_result(result_file_id) is None:
         raise HTTPException(status_code=404, detail="Result file not found or expired")
 
     try:
-        invoice = create_invoice(result_file_id)
+        invoice = await create_invoice(result_file_id)
     except RuntimeError as e:
         raise HTTPException(status_code=503, detail=str(e))
 
-    return JSONResponse(invoice)
+    return ORJSONResponse(invoice)
 
 
 @app.get("/api/download/{result_file_id}")
-async def download_result(result_file_id: str, token: str = "") -> FileResponse:
-    """Download the clean result file with a valid HMAC token."""
+async def download_result(request: Request, result_file_id: str, token: str = "") -> Response:
+    """Download the clean result file with a valid HMAC token.
+
+    Result files never change once written, so an ETag built from the id
+    and size lets a repeat download be answered with 304 Not Modified.
+    """
     if not token or not verify_download_token(result_file_id, token):
         raise HTTPException(status_code=403, detail="Invalid or missing download token")
 
-    found = list(OUTPUT_DIR.glob(f"{result_file_id}.*"))
-    if not found:
+    result_path = _find_result(result_file_id)
+    if result_path is None:
         raise HTTPException(status_code=404, detail="Result file not found or expired")
 
-    result_path = found[0]
     ext = result_path.suffix.lstrip(".")
     media_types = {"pdf": "application/pdf", "jpg": "image/jpeg", "png": "image/png"}
     media = media_types.get(ext, "application/octet-stream")
 
+    try:
+        stat = result_path.stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Result file not found or expired")
+    etag = f'"{result_file_id}-{stat.st_size}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=0, must-revalidate"}
+
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
     return FileResponse(
         path=str(result_path),
         filename=f"edited.{ext}",
         media_type=media,
+        headers=headers,
+        stat_result=stat,
     )
 
 
@@ -378,7 +800,7 @@ async def download_result(result_file_id: str, token: str = "") -> FileResponse:
 # ---------------------------------------------------------------------------
 
 @app.post("/webhook/cryptobot")
-async def cryptobot_webhook(request: Request) -> JSONResponse:
+async def cryptobot_webhook(request: Request) -> ORJSONResponse:
     """Handle CryptoBot webhook (invoice_paid event)."""
     body = await request.body()
     signature = request.headers.get("Crypto-Pay-Api-Signature", "")
@@ -388,8 +810,8 @@ async def cryptobot_webhook(request: Request) -> JSONResponse:
         raise HTTPException(status_code=400, detail="Invalid signature")
 
     try:
-        data = json.loads(body)
-    except json.JSONDecodeError:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
     logger.info("CryptoBot webhook received: %s", data.get("update_type"))
@@ -401,7 +823,7 @@ async def cryptobot_webhook(request: Request) -> JSONResponse:
             mark_paid(result_file_id)
             logger.info("Webhook: marked %s as paid", result_file_id)
 
-    return JSONResponse({"status": "ok"})
+    return ORJSONResponse({"status": "ok"})
 
 
 # ---------------------------------------------------------------------------
@@ -452,12 +874,25 @@ DOWNLOAD_PAGE_HTML = """<!DOCTYPE html>
 </body>
 </html>"""
 
+# The template never changes: render both variants once and splice only the
+# download URL in per request.
+_DOWNLOAD_URL_MARK = "\x00DLURL\x00"
+_DOWNLOAD_PAID_PRE, _, _DOWNLOAD_PAID_POST = DOWNLOAD_PAGE_HTML.format(
+    paid_class="",
+    waiting_class="hidden",
+    download_url=_DOWNLOAD_URL_MARK,
+).partition(_DOWNLOAD_URL_MARK)
+_DOWNLOAD_WAITING_BODY = DOWNLOAD_PAGE_HTML.format(
+    paid_class="hidden",
+    waiting_class="",
+    download_url="#",
+).encode()
+
 
 @app.get("/download-page/{result_file_id}")
 async def download_page(result_file_id: str) -> HTMLResponse:
     """Post-payment landing page with download link."""
-    found = list(OUTPUT_DIR.glob(f"{result_file_id}.*"))
-    if not found:
+    if _find_result(result_file_id) is None:
         raise HTTPException(status_code=404, detail="Result file not found or expired")
 
     paid = is_paid(result_file_id)
@@ -465,19 +900,9 @@ async def download_page(result_file_id: str) -> HTMLResponse:
     if paid:
         token = generate_download_token(result_file_id)
         download_url = f"{APP_BASE_URL}/api/download/{result_file_id}?token={token}"
-        html = DOWNLOAD_PAGE_HTML.format(
-            paid_class="",
-            waiting_class="hidden",
-            download_url=download_url,
-        )
-    else:
-        html = DOWNLOAD_PAGE_HTML.format(
-            paid_class="hidden",
-            waiting_class="",
-            download_url="#",
-        )
+        return HTMLResponse(_DOWNLOAD_PAID_PRE + download_url + _DOWNLOAD_PAID_POST)
 
-    return HTMLResponse(html)
+    return HTMLResponse(_DOWNLOAD_WAITING_BODY)
 
 
 # ---------------------------------------------------------------------------
@@ -490,10 +915,9 @@ VALID_NETWORKS = ("erc20", "bep20", "base", "solana")
 @app.post("/api/create-onchain-payment/{result_file_id}")
 async def create_onchain_payment(
     result_file_id: str, network: str = "erc20",
-) -> JSONResponse:
+) -> ORJSONResponse:
     """Create a pending on-chain payment with a unique amount."""
-    found = list(OUTPUT_DIR.glob(f"{result_file_id}.*"))
-    if not found:
+    if _find_result(result_file_id) is None:
         raise HTTPException(status_code=404, detail="Result file not found or expired")
 
     if network not in VALID_NETWORKS:
@@ -508,7 +932,7 @@ async def create_onchain_payment(
         network=network,
     )
 
-    return JSONResponse({
+    return ORJSONResponse({
         "amount": payment["amount"],
         "wallet": payment["wallet"],
         "network": network,
@@ -520,28 +944,33 @@ async def create_onchain_payment(
 
 
 @app.get("/api/check-onchain-payment/{result_file_id}")
-async def check_onchain_payment(result_file_id: str) -> JSONResponse:
+async def check_onchain_payment(result_file_id: str) -> ORJSONResponse:
     """Frontend polls this to check if on-chain payment was received."""
     data = check_onchain_paid(result_file_id)
+    headers = {"Cache-Control": "no-store"}
     if data:
-        return JSONResponse({"paid": True, "download_token": data["download_token"]})
-    return JSONResponse({"paid": False})
+        return ORJSONResponse({"paid": True, "download_token": data["download_token"]}, headers=headers)
+    return ORJSONResponse({"paid": False}, headers=headers)
 
 
 @app.post("/api/webhook/drops-bot")
-async def drops_bot_webhook(request: Request) -> JSONResponse:
+async def drops_bot_webhook(request: Request) -> ORJSONResponse:
     """Webhook for Drops Bot (EtherDrops) wallet notifications.
 
     Log everything initially — adjust parsing after seeing real payloads.
     """
     body = await request.body()
     try:
-        data = json.loads(body)
-    except json.JSONDecodeError:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
         logger.warning("Drops Bot webhook: invalid JSON body")
-        return JSONResponse({"status": "error"})
+        return ORJSONResponse({"status": "error"})
 
-    logger.info("Drops Bot webhook received: %s", json.dumps(data, indent=2, default=str))
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            "Drops Bot webhook received: %s",
+            orjson.dumps(data, default=str, option=orjson.OPT_INDENT_2).decode(),
+        )
 
     amount = None
     network = "erc20"
@@ -561,11 +990,11 @@ async def drops_bot_webhook(request: Request) -> JSONResponse:
         matched = match_incoming_payment(amount, network)
         if matched:
             logger.info("On-chain payment matched! Amount=%s File=%s", amount, matched["result_file_id"])
-            return JSONResponse({"status": "matched", "result_file_id": matched["result_file_id"]})
+            return ORJSONResponse({"status": "matched", "result_file_id": matched["result_file_id"]})
         else:
             logger.warning("On-chain payment received but no match. Amount=%s", amount)
 
-    return JSONResponse({"status": "received"})
+    return ORJSONResponse({"status": "received"})
 
 
 # ---------------------------------------------------------------------------
@@ -749,28 +1178,47 @@ ONCHAIN_PAY_HTML = """<!DOCTYPE html>
 </body>
 </html>"""
 
+# Split once at the placeholder so each request is a plain concatenation
+_ONCHAIN_PAY_PARTS = ONCHAIN_PAY_HTML.split("__RESULT_FILE_ID__")
+
 
 @app.get("/onchain-pay/{result_file_id}")
 async def onchain_payment_page(result_file_id: str) -> HTMLResponse:
     """Serve the on-chain payment page."""
-    found = list(OUTPUT_DIR.glob(f"{result_file_id}.*"))
-    if not found:
+    if _find_result(result_file_id) is None:
         raise HTTPException(status_code=404, detail="Result file not found or expired")
 
-    html = ONCHAIN_PAY_HTML.replace("__RESULT_FILE_ID__", result_file_id)
-    return HTMLResponse(html)
+    return HTMLResponse(result_file_id.join(_ONCHAIN_PAY_PARTS))
 
 
-# Serve frontend index at root
-@app.get("/")
-async def serve_index() -> FileResponse:
-    """Serve the frontend index.html."""
-    index_path = FRONTEND_DIR / "index.html"
-    if not index_path.exists():
-        raise HTTPException(status_code=404, detail="Frontend not found")
-    return FileResponse(str(index_path), media_type="text/html")
+# ---------------------------------------------------------------------------
+# Frontend
+# ---------------------------------------------------------------------------
+
+FRONTEND_DIR = BASE_DIR / "frontend"
+
+# Browser cache lifetime for frontend assets (index.html always revalidates)
+STATIC_MAX_AGE_SECONDS = 300
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that adds Cache-Control to every served file."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if str(full_path).endswith(".html"):
+            response.headers["Cache-Control"] = "no-cache"
+        else:
+            response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE_SECONDS}"
+        return response
+
+
+# Mounted last so every API route above is matched first; html=True serves
+# index.html at "/".
+if FRONTEND_DIR.exists():
+    app.mount("/", CachedStaticFiles(directory=str(FRONTEND_DIR), html=True), name="frontend")
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host=HOST, port=PORT, reload=True)
+    uvicorn.run("main:app", host=HOST, port=PORT, loop="uvloop", http="httptools", reload=True)
@@ -5,6 +5,7 @@ Handles invoice creation, webhook verification, download-token generation,
 and in-memory payment tracking (single-server deployment).
 """
 
+import functools
 import hashlib
 import hmac
 import logging
@@ -12,9 +13,11 @@ import random
 import time
 from decimal import Decimal
 
-import requests
+import httpx
+import orjson
 
-from config import APP_BASE_URL, CRYPTOBOT_API_TOKEN, CRYPTOBOT_API_URL, DOWNLOAD_SECRET
+from config import APP_BASE_URL, CRYPTOBOT_API_TOKEN, DOWNLOAD_SECRET
+from http_clients import get_cryptobot_client
 
 logger = logging.getLogger(__name__)
 
@@ -31,7 +34,7 @@ _payments: dict[str, dict] = {}
 # Invoice creation
 # ---------------------------------------------------------------------------
 
-def create_invoice(result_file_id: str) -> dict:
+async def create_invoice(result_file_id: str) -> dict:
     """Create a CryptoBot USDT invoice and track it.
 
     Returns dict with ``pay_url``, ``invoice_id``, ``amount``, ``currency``.
@@ -42,26 +45,25 @@ def create_invoice(result_file_id: str) -> dict:
 
     download_page_url = f"{APP_BASE_URL}/download-page/{result_file_id}"
 
-    resp = requests.post(
-        f"{CRYPTOBOT_API_URL}/createInvoice",
-        headers={
-            "Crypto-Pay-API-Token": CRYPTOBOT_API_TOKEN,
-            "Content-Type": "application/json",
-        },
-        json={
-            "asset": "USDT",
-            "amount": str(PAYMENT_PRICE_USD),
-            "description": "PDF Text Editor — edited document download",
-            "paid_btn_name": "viewItem",
-            "paid_btn_url": download_page_url,
-            "payload": result_file_id,
-            "allow_comments": False,
-            "allow_anonymous": True,
-        },
-        timeout=30,
-    )
-
-    data = resp.json()
+    try:
+        resp = await get_cryptobot_client().post(
+            "/createInvoice",
+            content=orjson.dumps({
+                "asset": "USDT",
+                "amount": str(PAYMENT_PRICE_USD),
+                "description": "PDF Text Editor — edited document download",
+                "paid_btn_name": "viewItem",
+                "paid_btn_url": download_page_url,
+                "payload": result_file_id,
+                "allow_comments": False,
+                "allow_anonymous": True,
+            }),
+        )
+    except httpx.HTTPError as e:
+        logger.error("CryptoBot request failed: %s", e)
+        raise RuntimeError("CryptoBot is unreachable") from e
+
+    data = orjson.loads(resp.content)
 
     if not data.get("ok"):
         error = data.get("error", {})
@@ -112,39 +114,68 @@ def is_paid(result_file_id: str) -> bool:
     return entry is not None and entry["status"] == "paid"
 
 
+def forget_payment(result_file_id: str) -> None:
+    """Drop all payment state for a result file (called once it is deleted).
+
+    Ties the lifetime of ``_payments`` entries to the file they pay for,
+    so the map stays bounded by the number of live results.
+    """
+    _payments.pop(result_file_id, None)
+    _onchain_paid.pop(result_file_id, None)
+
+
 # ---------------------------------------------------------------------------
 # Webhook signature verification
 # ---------------------------------------------------------------------------
 
+# CryptoBot signs the body with HMAC using SHA256(api_token) as the key.
+# The keyed state is built once; each request only copies it.
+_WEBHOOK_MAC = (
+    hmac.new(hashlib.sha256(CRYPTOBOT_API_TOKEN.encode()).digest(), digestmod=hashlib.sha256)
+    if CRYPTOBOT_API_TOKEN
+    else None
+)
+
+
 def verify_webhook_signature(body: bytes, signature: str) -> bool:
-    """Verify CryptoBot webhook HMAC-SHA256 signature.
+    """Verify CryptoBot webhook HMAC-SHA256 signature (constant-time).
 
-    CryptoBot signs the body with HMAC using SHA256(api_token) as the key.
+    Compares raw digests, so the body's MAC is never hex-encoded.
     """
-    if not CRYPTOBOT_API_TOKEN or not signature:
+    if _WEBHOOK_MAC is None or not signature:
+        return False
+    try:
+        expected = bytes.fromhex(signature)
+    except ValueError:
         return False
-    secret = hashlib.sha256(CRYPTOBOT_API_TOKEN.encode()).digest()
-    expected = hmac.new(secret, body, hashlib.sha256).hexdigest()
-    return hmac.compare_digest(signature, expected)
+    mac = _WEBHOOK_MAC.copy()
+    mac.update(body)
+    return hmac.compare_digest(mac.digest(), expected)
 
 
 # ---------------------------------------------------------------------------
 # Download token (HMAC-based)
 # ---------------------------------------------------------------------------
 
+_DOWNLOAD_MAC = hmac.new(DOWNLOAD_SECRET.encode(), digestmod=hashlib.sha256)
+
+
+@functools.lru_cache(maxsize=4096)
 def generate_download_token(result_file_id: str) -> str:
-    """Generate an HMAC-SHA256 token that authorises a file download."""
-    return hmac.new(
-        DOWNLOAD_SECRET.encode(),
-        result_file_id.encode(),
-        hashlib.sha256,
-    ).hexdigest()
+    """Generate an HMAC-SHA256 token that authorises a file download.
+
+    The token depends only on the file id and the fixed secret, so it is
+    memoised; polling and page refreshes skip the HMAC after the first call.
+    """
+    mac = _DOWNLOAD_MAC.copy()
+    mac.update(result_file_id.encode())
+    return mac.hexdigest()
 
 
 def verify_download_token(result_file_id: str, token: str) -> bool:
     """Return True if *token* is a valid download token for *result_file_id*."""
     expected = generate_download_token(result_file_id)
-    return hmac.compare_digest(token, expected)
+    return hmac.compare_digest(token.encode(), expected.encode())
 
 
 # ---------------------------------------------------------------------------
@@ -161,6 +192,15 @@ WALLETS = {
 # key = unique_amount (str), value = {result_file_id, created_at, network, ...}
 _pending_onchain: dict[str, dict] = {}
 
+# Confirmed on-chain payments by result_file_id (same dicts as above), so
+# status polls are a single lookup instead of a scan of every pending entry
+_onchain_paid: dict[str, dict] = {}
+
+# Unique amounts are 4-decimal slots; transfers match within ±0.001
+AMOUNT_STEP = Decimal("0.0001")
+AMOUNT_TOLERANCE = Decimal("0.001")
+_AMOUNT_OFFSETS = [0] + [o for d in range(1, 11) for o in (d, -d)]
+
 
 def generate_unique_amount(result_file_id: str) -> str:
     """Generate amount like 4.9901 … 4.9999 (99 unique slots)."""
@@ -204,17 +244,25 @@ def register_pending_payment(result_file_id: str, network: str) -> dict:
 
 
 def match_incoming_payment(amount_str: str, network: str) -> dict | None:
-    """Match incoming transfer amount to a pending payment (±0.001 tolerance)."""
+    """Match incoming transfer amount to a pending payment (±0.001 tolerance).
+
+    Looks up the nearest amount slots directly, closest first, rather than
+    comparing against every pending payment.
+    """
     try:
         incoming = Decimal(amount_str)
+        nearest = incoming.quantize(AMOUNT_STEP)
     except Exception:
         return None
 
-    for pending_amount, data in _pending_onchain.items():
-        if data["status"] != "pending":
+    for offset in _AMOUNT_OFFSETS:
+        candidate = nearest + offset * AMOUNT_STEP
+        data = _pending_onchain.get(f"{candidate:.4f}")
+        if data is None or data["status"] != "pending":
             continue
-        if abs(incoming - Decimal(pending_amount)) <= Decimal("0.001"):
+        if abs(incoming - candidate) <= AMOUNT_TOLERANCE:
             data["status"] = "paid"
+            _onchain_paid[data["result_file_id"]] = data
             # Also mark in the main _payments dict so download-page works
             mark_paid(data["result_file_id"])
             logger.info("On-chain payment matched: %s → file %s", amount_str, data["result_file_id"])
@@ -224,10 +272,7 @@ def match_incoming_payment(amount_str: str, network: str) -> dict | None:
 
 def check_onchain_paid(result_file_id: str) -> dict | None:
     """Return payment data if on-chain payment was confirmed for this file."""
-    for _amount, data in _pending_onchain.items():
-        if data["result_file_id"] == result_file_id and data["status"] == "paid":
-            return data
-    return None
+    return _onchain_paid.get(result_file_id)
 
 
 def cleanup_expired_payments(max_age_seconds: int = 1800) -> None:
@@ -236,6 +281,8 @@ def cleanup_expired_payments(max_age_seconds: int = 1800) -> None:
     expired = [k for k, v in _pending_onchain.items()
                if now - v["created_at"] > max_age_seconds]
     for k in expired:
-        del _pending_onchain[k]
+        data = _pending_onchain.pop(k)
+        if _onchain_paid.get(data["result_file_id"]) is data:
+            del _onchain_paid[data["result_file_id"]]
     if expired:
         logger.info("Cleaned up %d expired on-chain payments", len(expired))
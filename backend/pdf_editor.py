@@ -4,7 +4,9 @@ Finds target words/phrases in a PDF and replaces them with new text,
 preserving original font, size, color, and position.
 """
 
+import functools
 import logging
+from bisect import bisect_left
 from dataclasses import dataclass
 from pathlib import Path
 
@@ -12,6 +14,29 @@ import fitz  # PyMuPDF
 
 logger = logging.getLogger(__name__)
 
+# Options for writing an edited document: drop unused objects, recompress
+# every stream, and linearise for Fast Web View. garbage=4 also merges the
+# font streams re-inserted from a document's own embedded fonts. Content
+# streams are not re-cleaned: apply_redactions has already rewritten every
+# edited page's, and cleaning them all again was most of the save time.
+PDF_SAVE_OPTIONS = {
+    "garbage": 4,
+    "deflate": True,
+    "deflate_images": True,
+    "deflate_fonts": True,
+    "clean": False,
+    "linear": True,
+}
+
+# Same extraction flags as Page.search_for's default, so one TextPage can
+# serve both the per-page term check and every search on that page
+SEARCH_FLAGS = (
+    fitz.TEXT_DEHYPHENATE
+    | fitz.TEXT_PRESERVE_WHITESPACE
+    | fitz.TEXT_PRESERVE_LIGATURES
+    | fitz.TEXT_MEDIABOX_CLIP
+)
+
 
 @dataclass
 class SpanInfo:
@@ -22,7 +47,7 @@ class SpanInfo:
     size: float
     color: int
     flags: int
-    bbox: fitz.Rect
+    bbox: tuple[float, float, float, float]  # (x0, y0, x1, y1)
     origin: tuple[float, float]  # baseline insertion point (x, y)
     page_num: int
 
@@ -38,7 +63,11 @@ class ReplacementResult:
 
 
 def _extract_spans(page: fitz.Page, page_num: int) -> list[SpanInfo]:
-    """Extract all text spans from a page with full metadata including origin."""
+    """Extract all text spans from a page with full metadata including origin.
+
+    The bbox is kept as the plain tuple MuPDF returns; building a
+    ``fitz.Rect`` per span costs more than the overlap test needs.
+    """
     spans: list[SpanInfo] = []
     blocks = page.get_text("dict", flags=fitz.TEXT_PRESERVE_WHITESPACE)["blocks"]
 
@@ -49,7 +78,8 @@ def _extract_spans(page: fitz.Page, page_num: int) -> list[SpanInfo]:
             for span in line.get("spans", []):
                 if not span["text"].strip():
                     continue
-                origin = span.get("origin", (span["bbox"][0], span["bbox"][3]))
+                bbox = span["bbox"]
+                origin = span.get("origin", (bbox[0], bbox[3]))
                 spans.append(
                     SpanInfo(
                         text=span["text"],
@@ -57,7 +87,7 @@ def _extract_spans(page: fitz.Page, page_num: int) -> list[SpanInfo]:
                         size=span["size"],
                         color=span["color"],
                         flags=span["flags"],
-                        bbox=fitz.Rect(span["bbox"]),
+                        bbox=bbox,
                         origin=(origin[0], origin[1]),
                         page_num=page_num,
                     )
@@ -65,18 +95,62 @@ def _extract_spans(page: fitz.Page, page_num: int) -> list[SpanInfo]:
     return spans
 
 
-def _resolve_font(original_font: str) -> str:
-    """Map original font name to a usable Base-14 font for insertion."""
-    base14 = [
+class _SpanIndex:
+    """A page's spans sorted by top edge, to find those a search hit overlaps.
+
+    Only spans starting within one span-height above the hit, and before
+    its bottom edge, can intersect it, so each lookup bisects to that band
+    instead of testing every span on the page.
+    """
+
+    def __init__(self, spans: list[SpanInfo]) -> None:
+        self._spans = spans
+        self._order = sorted(range(len(spans)), key=lambda i: spans[i].bbox[1])
+        self._tops = [spans[i].bbox[1] for i in self._order]
+        self._max_height = max((s.bbox[3] - s.bbox[1] for s in spans), default=0.0)
+
+    def best_match(self, rect: fitz.Rect) -> SpanInfo | None:
+        """Return the span with the largest overlap with *rect* (first on ties)."""
+        rx0, ry0, rx1, ry1 = rect
+        lo = bisect_left(self._tops, ry0 - self._max_height)
+        hi = bisect_left(self._tops, ry1, lo)
+        best_span: SpanInfo | None = None
+        best_overlap = 0.0
+        # Visit candidates in extraction order so ties resolve as a full scan would
+        for i in sorted(self._order[lo:hi]):
+            span = self._spans[i]
+            sx0, sy0, sx1, sy1 = span.bbox
+            # Intersection computed on the floats directly (Rect & is slow)
+            width = min(sx1, rx1) - max(sx0, rx0)
+            height = min(sy1, ry1) - max(sy0, ry0)
+            if width <= 0 or height <= 0:
+                continue
+            overlap = width * height
+            if overlap > best_overlap:
+                best_overlap = overlap
+                best_span = span
+        return best_span
+
+
+_BASE14 = [
+    (name, name.lower())
+    for name in (
         "Helvetica", "Helvetica-Bold", "Helvetica-Oblique", "Helvetica-BoldOblique",
         "Times-Roman", "Times-Bold", "Times-Italic", "Times-BoldItalic",
         "Courier", "Courier-Bold", "Courier-Oblique", "Courier-BoldOblique",
         "Symbol", "ZapfDingbats",
-    ]
+    )
+]
 
+
+# Called for every replacement instance, but documents reuse a handful of
+# font names, so nearly every call is a cache hit
+@functools.lru_cache(maxsize=256)
+def _resolve_font(original_font: str) -> str:
+    """Map original font name to a usable Base-14 font for insertion."""
     font_lower = original_font.lower()
-    for b14 in base14:
-        if b14.lower() in font_lower:
+    for b14, b14_lower in _BASE14:
+        if b14_lower in font_lower:
             return b14
 
     if "arial" in font_lower or "helvetica" in font_lower or "sans" in font_lower:
@@ -115,70 +189,111 @@ def _int_to_rgb(color_int: int) -> tuple[float, float, float]:
     return (r, g, b)
 
 
-def _try_extract_font(doc: fitz.Document, page: fitz.Page, font_name: str) -> str | None:
-    """Try to extract an embedded font and register it for reuse.
+class _FontRegistry:
+    """Embedded fonts of one document, extracted and registered once.
 
-    Returns the registered fontname if successful, None otherwise.
+    Replacing many instances would otherwise re-read the page's font list
+    and decompress the same font stream for every single insertion.
     """
-    try:
-        fonts = page.get_fonts(full=True)
-        for font_info in fonts:
-            xref = font_info[0]
-            fname = font_info[3]  # font basename
-            refname = font_info[4]  # reference name used in page
-
-            if fname == font_name or refname == font_name:
-                font_data = doc.extract_font(xref)
-                if font_data and font_data[3]:  # has binary content
-                    registered = page.insert_font(
-                        fontname=refname,
-                        fontbuffer=font_data[3],
-                    )
-                    if registered:
-                        return registered
-    except Exception as e:
-        logger.debug("Could not extract font '%s': %s", font_name, e)
-    return None
+
+    def __init__(self, doc: fitz.Document) -> None:
+        self.doc = doc
+        # xref -> font file contents (None if not embedded)
+        self._buffers: dict[int, bytes | None] = {}
+        # (page number, font name) -> registered fontname (None if unavailable)
+        self._registered: dict[tuple[int, str], str | None] = {}
+        # page number -> page.get_fonts(full=True)
+        self._page_fonts: dict[int, list[tuple]] = {}
+
+    def _fonts_on(self, page: fitz.Page) -> list[tuple]:
+        """List a page's fonts, walking its resources once until a font is added."""
+        fonts = self._page_fonts.get(page.number)
+        if fonts is None:
+            fonts = self._page_fonts[page.number] = page.get_fonts(full=True)
+        return fonts
+
+    def _font_buffer(self, xref: int) -> bytes | None:
+        """Extract a font's file contents, once per xref for the whole document."""
+        if xref not in self._buffers:
+            font_data = self.doc.extract_font(xref)
+            self._buffers[xref] = font_data[3] if font_data and font_data[3] else None
+        return self._buffers[xref]
+
+    def register(self, page: fitz.Page, font_name: str) -> str | None:
+        """Try to extract an embedded font and register it for reuse.
+
+        Returns the registered fontname if successful, None otherwise.
+        The outcome is remembered per page, so repeat calls are lookups.
+        """
+        key = (page.number, font_name)
+        if key not in self._registered:
+            self._registered[key] = self._register(page, font_name)
+        return self._registered[key]
+
+    def _register(self, page: fitz.Page, font_name: str) -> str | None:
+        try:
+            for font_info in self._fonts_on(page):
+                xref = font_info[0]
+                fname = font_info[3]  # font basename
+                refname = font_info[4]  # reference name used in page
+
+                if fname == font_name or refname == font_name:
+                    font_buffer = self._font_buffer(xref)
+                    if font_buffer:  # has binary content
+                        registered = page.insert_font(
+                            fontname=refname,
+                            fontbuffer=font_buffer,
+                        )
+                        if registered:
+                            self._page_fonts.pop(page.number, None)
+                            return registered
+        except Exception as e:
+            logger.debug("Could not extract font '%s': %s", font_name, e)
+        return None
 
 
-def _replace_on_page(
-    doc: fitz.Document,
+def _plan_replacements(
     page: fitz.Page,
     page_num: int,
-    search_text: str,
-    replace_text: str,
-    case_sensitive: bool,
-) -> int:
-    """Replace all occurrences of search_text with replace_text on a page.
+    terms: list[tuple[int, str, str]],
+    textpage: fitz.TextPage,
+) -> list[dict]:
+    """Find every hit of every term on a page, with the formatting to reuse.
 
-    Uses span-level metadata for precise font, size, color, and baseline
-    position matching.
+    All terms are searched on the same *textpage* before the page changes,
+    and span-level metadata gives each hit its font, size, color and
+    baseline. A hit overlapping one of an earlier term's hits is dropped,
+    so overlapping terms resolve in the order given.
+
+    Args:
+        page: Page to search.
+        page_num: Zero-based page number.
+        terms: (term index, search text, replacement text) per term.
+        textpage: Current text of *page*, extracted with SEARCH_FLAGS.
 
-    Returns the number of replacements made.
+    Returns:
+        One dict per hit to replace, tagged with its term index.
     """
-    # Find all instances using PyMuPDF search
-    text_instances = page.search_for(search_text)
-    if not text_instances:
-        return 0
+    hits: list[tuple[int, str, fitz.Rect]] = []
+    for term, search_text, replace_text in terms:
+        # Plain tuples: Rect.__and__ is far too slow to call per pair
+        earlier = [tuple(rect) for _, _, rect in hits]
+        for inst_rect in page.search_for(search_text, textpage=textpage):
+            x0, y0, x1, y1 = inst_rect
+            if any(x0 < bx1 and bx0 < x1 and y0 < by1 and by0 < y1 for bx0, by0, bx1, by1 in earlier):
+                continue
+            hits.append((term, replace_text, inst_rect))
+    if not hits:
+        return []
 
     # Extract all spans with full metadata (including origin/baseline)
-    spans = _extract_spans(page, page_num)
+    spans = _SpanIndex(_extract_spans(page, page_num))
 
     # For each found instance, collect its specific font properties
     instance_data: list[dict] = []
-    for inst_rect in text_instances:
+    for term, replace_text, inst_rect in hits:
         # Find the span that best overlaps this instance
-        best_span: SpanInfo | None = None
-        best_overlap = 0.0
-
-        for span in spans:
-            intersection = span.bbox & inst_rect  # intersection rect
-            if intersection.is_empty:
-                continue
-            overlap = intersection.width * intersection.height
-            if overlap > best_overlap:
-                best_overlap = overlap
-                best_span = span
+        best_span = spans.best_match(inst_rect)
 
         if best_span:
             # Use the span's exact origin for baseline positioning
@@ -187,6 +302,8 @@ def _replace_on_page(
             insert_y = best_span.origin[1]
 
             instance_data.append({
+                "term": term,
+                "text": replace_text,
                 "rect": inst_rect,
                 "font": best_span.font,
                 "size": best_span.size,
@@ -199,6 +316,8 @@ def _replace_on_page(
             # Baseline is typically ~80% down from top of bbox
             baseline_y = inst_rect.y0 + (inst_rect.height * 0.82)
             instance_data.append({
+                "term": term,
+                "text": replace_text,
                 "rect": inst_rect,
                 "font": "Helvetica",
                 "size": 11.0,
@@ -207,9 +326,23 @@ def _replace_on_page(
                 "origin": (inst_rect.x0, baseline_y),
             })
 
-    if not instance_data:
-        return 0
+    return instance_data
+
 
+def _apply_replacements(
+    fonts: _FontRegistry,
+    page: fitz.Page,
+    instance_data: list[dict],
+) -> dict[int, int]:
+    """Redact every planned hit at once, then insert the replacement texts.
+
+    ``apply_redactions`` rewrites the page's content stream, and each
+    committed insertion rescans it, so both happen once per page: all
+    texts are drawn on one shape that is committed at the end.
+
+    Returns:
+        Number of replacements made per term index.
+    """
     # Phase 1: Add redaction annotations for all instances
     for data in instance_data:
         page.add_redact_annot(data["rect"])
@@ -218,15 +351,17 @@ def _replace_on_page(
     page.apply_redactions()
 
     # Phase 2: Insert new text at each position with original formatting
-    count = 0
+    shape = page.new_shape()
+    counts: dict[int, int] = {}
     for data in instance_data:
         font_name_original = data["font"]
         font_size = data["size"]
         font_color = _int_to_rgb(data["color"])
         origin = data["origin"]
+        replace_text = data["text"]
 
         # Try to reuse the embedded font first
-        registered_font = _try_extract_font(doc, page, font_name_original)
+        registered_font = fonts.register(page, font_name_original)
 
         if registered_font:
             fontname_to_use = registered_font
@@ -236,48 +371,50 @@ def _replace_on_page(
         insert_point = fitz.Point(origin[0], origin[1])
 
         try:
-            page.insert_text(
+            shape.insert_text(
                 insert_point,
                 replace_text,
                 fontname=fontname_to_use,
                 fontsize=font_size,
                 color=font_color,
             )
-            count += 1
         except Exception as e:
             logger.warning(
                 "Failed with font '%s' (from '%s'), trying Helvetica: %s",
                 fontname_to_use, font_name_original, e,
             )
             try:
-                page.insert_text(
+                shape.insert_text(
                     insert_point,
                     replace_text,
                     fontname="helv",
                     fontsize=font_size,
                     color=font_color,
                 )
-                count += 1
             except Exception as e2:
                 logger.error("Text insertion failed completely: %s", e2)
+                continue
+        counts[data["term"]] = counts.get(data["term"], 0) + 1
 
-    return count
+    if counts:
+        shape.commit()
+    return counts
 
 
-def replace_text(
+def _normalise_search_text(text: str) -> str:
+    """Lower-case and collapse whitespace, as MuPDF's search matches loosely."""
+    return " ".join(text.split()).lower()
+
+
+def edit_document(
     pdf_path: str | Path,
     replacements: dict[str, str],
     case_sensitive: bool = True,
-) -> tuple[bytes, list[ReplacementResult]]:
-    """Replace text in a PDF file while preserving formatting.
-
-    Args:
-        pdf_path: Path to the source PDF file.
-        replacements: Mapping of old_text -> new_text.
-        case_sensitive: Whether search is case-sensitive.
+) -> tuple[fitz.Document, list[ReplacementResult]]:
+    """Replace text in a PDF file and return the edited, still-open document.
 
-    Returns:
-        Tuple of (modified PDF bytes, list of replacement results).
+    Lets callers render and save from one parsed document instead of
+    serializing to bytes and re-opening. The caller must close it.
 
     Raises:
         FileNotFoundError: If pdf_path does not exist.
@@ -288,29 +425,43 @@ def replace_text(
         raise FileNotFoundError(f"PDF not found: {pdf_path}")
 
     doc = fitz.open(str(pdf_path))
+    fonts = _FontRegistry(doc)
     results: list[ReplacementResult] = []
 
+    terms = [(old, new) for old, new in replacements.items() if old]
+    needles = [_normalise_search_text(old) for old, _ in terms]
+    totals = [0] * len(terms)
+
     try:
-        for search_text, new_text in replacements.items():
-            if not search_text:
+        # Pages are independent, so each is visited once for all terms: one
+        # text extraction tells which terms can occur at all and serves every
+        # search, and all hits are redacted together.
+        for page_num in range(len(doc)):
+            page = doc[page_num]
+            textpage = page.get_textpage(flags=SEARCH_FLAGS)
+            page_text = _normalise_search_text(textpage.extractText())
+            present = [
+                (i, search_text, new_text)
+                for i, (search_text, new_text) in enumerate(terms)
+                if needles[i] in page_text
+            ]
+            if not present:
                 continue
-
-            total_count = 0
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                count = _replace_on_page(
-                    doc, page, page_num, search_text, new_text, case_sensitive
+            instance_data = _plan_replacements(page, page_num, present, textpage)
+            if not instance_data:
+                continue
+            counts = _apply_replacements(fonts, page, instance_data)
+            for i, count in sorted(counts.items()):
+                totals[i] += count
+                logger.info(
+                    "Page %d: replaced '%s' → '%s' (%d times)",
+                    page_num + 1,
+                    terms[i][0],
+                    terms[i][1],
+                    count,
                 )
-                if count > 0:
-                    total_count += count
-                    logger.info(
-                        "Page %d: replaced '%s' → '%s' (%d times)",
-                        page_num + 1,
-                        search_text,
-                        new_text,
-                        count,
-                    )
 
+        for (search_text, new_text), total_count in zip(terms, totals):
             results.append(
                 ReplacementResult(
                     original=search_text,
@@ -319,9 +470,38 @@ def replace_text(
                     count=total_count,
                 )
             )
+    except BaseException:
+        doc.close()
+        raise
+
+    return doc, results
+
 
-        output_bytes = doc.tobytes(deflate=True, garbage=4)
+def replace_text(
+    pdf_path: str | Path,
+    replacements: dict[str, str],
+    case_sensitive: bool = True,
+) -> tuple[bytes, list[ReplacementResult]]:
+    """Replace text in a PDF file while preserving formatting.
+
+    Args:
+        pdf_path: Path to the source PDF file.
+        replacements: Mapping of old_text -> new_text.
+        case_sensitive: Whether search is case-sensitive.
+
+    Returns:
+        Tuple of (modified PDF bytes, list of replacement results).
+
+    Raises:
+        FileNotFoundError: If pdf_path does not exist.
+        RuntimeError: If PDF processing fails critically.
+    """
+    doc, results = edit_document(pdf_path, replacements, case_sensitive)
+    try:
+        output_bytes = doc.tobytes(**PDF_SAVE_OPTIONS)
     finally:
         doc.close()
+        # Nothing cached for this document is reusable by the next one
+        fitz.TOOLS.store_shrink(100)
 
     return output_bytes, results
@@ -5,8 +5,15 @@ paints over original text, and draws replacement text.
 Used when PyMuPDF cannot handle embedded/encrypted fonts.
 """
 
+import functools
 import logging
+import os
+import re
+from bisect import bisect_left
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from itertools import accumulate
 from pathlib import Path
 
 import pytesseract
@@ -20,6 +27,11 @@ logger = logging.getLogger(__name__)
 # DPI for rasterization
 RENDER_DPI = 300
 
+# Pages OCR'd at once. Each page's Tesseract run is a separate process, so
+# threads overlap them without pickling page images; the fallback already
+# runs inside a worker process, hence the small cap.
+OCR_MAX_WORKERS = min(4, os.cpu_count() or 1)
+
 # Try to find a usable TrueType font
 _FONT_CANDIDATES = [
     "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
@@ -31,8 +43,9 @@ _FONT_CANDIDATES = [
 ]
 
 
+@functools.lru_cache(maxsize=1)
 def _find_system_font() -> str | None:
-    """Find the first available TrueType font on the system."""
+    """Find the first available TrueType font on the system (once per process)."""
     for path in _FONT_CANDIDATES:
         if Path(path).exists():
             return path
@@ -55,30 +68,42 @@ def _detect_background_color(
 ) -> tuple[int, int, int]:
     """Estimate the background color around a text bounding box.
 
-    Samples pixels just outside the bbox edges and returns the most
-    common color (simple mode estimation).
+    Samples pixels just outside the bbox edges of the RGB image and
+    returns the most common color (simple mode estimation).
     """
     x0, y0, x1, y1 = bbox
     w, h = img.size
-    pixels: list[tuple[int, int, int]] = []
-
-    # Sample pixels above the bbox
-    for x in range(max(0, x0), min(w, x1)):
+    left, right = max(0, x0), min(w, x1)
+    rows: list[Image.Image] = []
+    if right > left:
+        # Sample pixels above the bbox
         if y0 - 1 >= 0:
-            pixels.append(img.getpixel((x, y0 - 1))[:3])  # type: ignore[index]
-    # Sample pixels below
-    for x in range(max(0, x0), min(w, x1)):
+            rows.append(img.crop((left, y0 - 1, right, y0)))
+        # Sample pixels below
         if y1 < h:
-            pixels.append(img.getpixel((x, y1))[:3])  # type: ignore[index]
+            rows.append(img.crop((left, y1, right, y1 + 1)))
 
-    if not pixels:
+    # getcolors builds each row's histogram in C; a row has at most
+    # `width` distinct colours
+    counter: Counter[tuple[int, int, int]] = Counter()
+    for row in rows:
+        for n, color in row.getcolors(row.width):
+            counter[color] += n
+
+    if not counter:
         return (255, 255, 255)  # default white
 
     # Simple mode: most common color
-    from collections import Counter
-
-    counter = Counter(pixels)
-    return counter.most_common(1)[0][0]
+    best = max(counter.values())
+    modes = {color for color, n in counter.items() if n == best}
+    if len(modes) == 1:
+        return modes.pop()
+    # Break ties by first occurrence, as counting pixel by pixel did
+    for row in rows:
+        for color in row.getdata():
+            if color in modes:
+                return color
+    return min(modes)  # unreachable: every mode occurs in some row
 
 
 def _ocr_and_replace(
@@ -89,89 +114,112 @@ def _ocr_and_replace(
 
     Returns the modified image and a count of replacements per search term.
     """
-    # Get word-level bounding boxes via pytesseract
-    data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT)
+    # Get word-level bounding boxes via pytesseract. Tesseract works in
+    # grayscale anyway; handing it "L" writes a third of the bytes to its
+    # temp file.
+    data = pytesseract.image_to_data(img.convert("L"), output_type=pytesseract.Output.DICT)
     counts: dict[str, int] = {k: 0 for k in replacements}
     draw = ImageDraw.Draw(img)
+    # Loaded fonts by pixel size. Kept per call rather than per process:
+    # pages are drawn on concurrent threads and a FreeType face must not
+    # be shared between them.
+    fonts: dict[int, ImageFont.FreeTypeFont | ImageFont.ImageFont] = {}
 
     n_boxes = len(data["text"])
+    # Normalise the OCR words once for all terms; the joined form tells
+    # whether a term can match anywhere on the page before scanning boxes
+    words = [t.strip() for t in data["text"]]
+    words_lower = [w.lower() for w in words]
+    haystack = "\0" + "\0".join(words_lower) + "\0"
+    # Haystack offset of each word's leading delimiter, built on first use
+    word_starts: list[int] | None = None
+
     for search_text, replace_text in replacements.items():
         search_lower = search_text.lower()
 
-        # Single-word search
-        for i in range(n_boxes):
-            word = data["text"][i].strip()
-            if not word:
-                continue
-
-            if word.lower() == search_lower or search_lower in word.lower():
-                x = data["left"][i]
-                y = data["top"][i]
-                w = data["width"][i]
-                h = data["height"][i]
-
-                if w <= 0 or h <= 0:
+        # Single-word search (only if some word contains the term)
+        if search_lower in haystack:
+            pattern = re.compile(re.escape(search_text), re.IGNORECASE)
+            for i in range(n_boxes):
+                word = words[i]
+                if not word:
                     continue
 
-                bbox = (x, y, x + w, y + h)
+                word_lower = words_lower[i]
+                if search_lower in word_lower:
+                    x = data["left"][i]
+                    y = data["top"][i]
+                    w = data["width"][i]
+                    h = data["height"][i]
 
-                # Detect background color and paint over
-                bg_color = _detect_background_color(img, bbox)
-                draw.rectangle(bbox, fill=bg_color)
-
-                # Calculate font size to fit the bbox
-                font_size = max(int(h * 0.85), 8)
-                font = _get_font(font_size)
+                    if w <= 0 or h <= 0:
+                        continue
 
-                # If replacement text is the full word replacement
-                if word.lower() == search_lower:
-                    new_word = replace_text
-                else:
-                    # Partial replacement within the word
-                    import re
+                    bbox = (x, y, x + w, y + h)
 
-                    new_word = re.sub(
-                        re.escape(search_text), replace_text, word, flags=re.IGNORECASE
-                    )
+                    # Detect background color and paint over
+                    bg_color = _detect_background_color(img, bbox)
+                    draw.rectangle(bbox, fill=bg_color)
 
-                # Draw new text
-                draw.text((x, y), new_word, fill=(0, 0, 0), font=font)
-                counts[search_text] += 1
+                    # Calculate font size to fit the bbox
+                    font_size = max(int(h * 0.85), 8)
+                    if font_size not in fonts:
+                        fonts[font_size] = _get_font(font_size)
+                    font = fonts[font_size]
+
+                    # If replacement text is the full word replacement
+                    if word_lower == search_lower:
+                        new_word = replace_text
+                    else:
+                        # Partial replacement within the word
+                        new_word = pattern.sub(replace_text, word)
+
+                    # Draw new text
+                    draw.text((x, y), new_word, fill=(0, 0, 0), font=font)
+                    counts[search_text] += 1
 
         # Multi-word phrase search: concatenate consecutive words
         if " " in search_text:
             words_in_phrase = search_text.lower().split()
             phrase_len = len(words_in_phrase)
+            needle = "\0" + "\0".join(words_in_phrase) + "\0"
+            match_at = haystack.find(needle)
+            if match_at < 0:
+                continue
 
-            for i in range(n_boxes - phrase_len + 1):
-                # Check if consecutive words match the phrase
-                window = []
-                for j in range(phrase_len):
-                    w = data["text"][i + j].strip().lower()
-                    window.append(w)
-
-                if window == words_in_phrase:
-                    # Calculate combined bounding box
-                    x0 = data["left"][i]
-                    y0 = min(data["top"][i + j] for j in range(phrase_len))
-                    x1 = max(
-                        data["left"][i + j] + data["width"][i + j]
-                        for j in range(phrase_len)
-                    )
-                    y1 = max(
-                        data["top"][i + j] + data["height"][i + j]
-                        for j in range(phrase_len)
-                    )
-                    h = y1 - y0
-
-                    bbox = (x0, y0, x1, y1)
-                    bg_color = _detect_background_color(img, bbox)
-                    draw.rectangle(bbox, fill=bg_color)
+            if word_starts is None:
+                word_starts = list(accumulate((len(w) + 1 for w in words_lower[:-1]), initial=0))
+
+            # Each hit of the delimited phrase in the haystack is a run of
+            # consecutive words equal to it, starting at the word whose
+            # leading delimiter is at the hit
+            while match_at >= 0:
+                i = bisect_left(word_starts, match_at)
+                # Calculate combined bounding box
+                x0 = data["left"][i]
+                y0 = min(data["top"][i + j] for j in range(phrase_len))
+                x1 = max(
+                    data["left"][i + j] + data["width"][i + j]
+                    for j in range(phrase_len)
+                )
+                y1 = max(
+                    data["top"][i + j] + data["height"][i + j]
+                    for j in range(phrase_len)
+                )
+                h = y1 - y0
+
+                bbox = (x0, y0, x1, y1)
+                bg_color = _detect_background_color(img, bbox)
+                draw.rectangle(bbox, fill=bg_color)
 
-                    font_size = max(int(h * 0.85), 8)
-                    font = _get_font(font_size)
-                    draw.text((x0, y0), replace_text, fill=(0, 0, 0), font=font)
-                    counts[search_text] += 1
+                font_size = max(int(h * 0.85), 8)
+                if font_size not in fonts:
+                    fonts[font_size] = _get_font(font_size)
+                font = fonts[font_size]
+                draw.text((x0, y0), replace_text, fill=(0, 0, 0), font=font)
+                counts[search_text] += 1
+
+                match_at = haystack.find(needle, match_at + 1)
 
     return img, counts
 
@@ -179,6 +227,7 @@ def _ocr_and_replace(
 def replace_text_raster(
     pdf_path: str | Path,
     replacements: dict[str, str],
+    dpi: int = RENDER_DPI,
 ) -> tuple[bytes, list[ReplacementResult]]:
     """Replace text in PDF using raster (OCR) method.
 
@@ -188,6 +237,7 @@ def replace_text_raster(
     Args:
         pdf_path: Path to the source PDF file.
         replacements: Mapping of old_text -> new_text.
+        dpi: Rasterisation resolution, also that of the output PDF.
 
     Returns:
         Tuple of (modified PDF bytes, list of replacement results).
@@ -202,21 +252,28 @@ def replace_text_raster(
 
     # Convert PDF to images
     try:
-        images = convert_from_path(str(pdf_path), dpi=RENDER_DPI)
+        images = convert_from_path(str(pdf_path), dpi=dpi, thread_count=OCR_MAX_WORKERS)
     except Exception as e:
         raise RuntimeError(f"Failed to convert PDF to images: {e}")
 
+    def process_page(page_num: int) -> tuple[Image.Image, dict[str, int]]:
+        logger.info("Processing page %d (raster method)...", page_num + 1)
+        img = images[page_num]
+        # pdftoppm already yields RGB; only convert (copy) other modes
+        img_rgb = img if img.mode == "RGB" else img.convert("RGB")
+        return _ocr_and_replace(img_rgb, replacements)
+
     total_counts: dict[str, int] = {k: 0 for k in replacements}
     processed_images: list[Image.Image] = []
 
-    for page_num, img in enumerate(images):
-        logger.info("Processing page %d (raster method)...", page_num + 1)
-        img_rgb = img.convert("RGB")
-        processed, page_counts = _ocr_and_replace(img_rgb, replacements)
-        processed_images.append(processed)
+    # Pages are independent; map() keeps them in document order
+    workers = max(1, min(OCR_MAX_WORKERS, len(images)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for processed, page_counts in pool.map(process_page, range(len(images))):
+            processed_images.append(processed)
 
-        for k, v in page_counts.items():
-            total_counts[k] += v
+            for k, v in page_counts.items():
+                total_counts[k] += v
 
     # Assemble back into PDF
     if not processed_images:
@@ -230,10 +287,10 @@ def replace_text_raster(
             format="PDF",
             save_all=True,
             append_images=processed_images[1:],
-            resolution=RENDER_DPI,
+            resolution=dpi,
         )
     else:
-        first_img.save(output_buf, format="PDF", resolution=RENDER_DPI)
+        first_img.save(output_buf, format="PDF", resolution=dpi)
 
     results = [
         ReplacementResult(
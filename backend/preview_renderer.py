@@ -0,0 +1,121 @@
+"""Watermarked page preview rendering.
+
+Rendering is CPU-bound and PyMuPDF is not thread-safe, so these functions
+run in worker processes (see ``main._get_worker_executor``). Each call
+opens its own ``fitz.Document``; only paths, bytes and ints cross the
+process boundary.
+"""
+
+import math
+import os
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+from watermark import add_watermark
+
+PREVIEW_DPI = 150
+PREVIEW_MIN_DPI = 72
+PREVIEW_JPEG_QUALITY = 80
+
+# Total preview pixels per document; long documents get a lower DPI so the
+# full set of previews stays bounded (~9 A4 pages fit at 150 dpi)
+PREVIEW_PIXEL_BUDGET = 20_000_000
+
+
+def preview_dpi(doc: fitz.Document, max_dpi: int = PREVIEW_DPI) -> int:
+    """Pick a preview DPI that keeps all pages within PREVIEW_PIXEL_BUDGET.
+
+    Depends only on the document, so every page of it gets the same DPI
+    whichever worker renders it.
+    """
+    page_count = len(doc)
+    # page_cropbox reads the page size without loading the page
+    area_sq_in = sum(abs(doc.page_cropbox(i)) for i in range(page_count)) / (72 * 72)
+    if area_sq_in <= 0:
+        return max_dpi
+    dpi = int(math.sqrt(PREVIEW_PIXEL_BUDGET / area_sq_in))
+    return max(PREVIEW_MIN_DPI, min(max_dpi, dpi))
+
+
+def release_store() -> None:
+    """Empty MuPDF's resource store after a job's document is closed.
+
+    Workers are long-lived and every job opens a different document, so
+    cached fonts and images from earlier jobs are never reused; without
+    this each worker would hold on to them up to the store limit.
+    """
+    fitz.TOOLS.store_shrink(100)
+
+
+def warm_up() -> None:
+    """Initialise MuPDF and the watermark font path with a blank render.
+
+    Used as the process-pool initializer so every worker pays this once
+    at start-up instead of on its first real preview.
+    """
+    doc = fitz.open()
+    try:
+        page = doc.new_page(width=72, height=72)
+        add_watermark(page)
+        page.get_pixmap(dpi=72, alpha=False).tobytes("jpeg")
+    finally:
+        doc.close()
+
+
+def render_page(page: fitz.Page, out_path: str | Path, dpi: int = PREVIEW_DPI) -> None:
+    """Render one page as a watermarked JPEG and write it to *out_path*.
+
+    The watermark is drawn onto the page itself, so MuPDF rasterises and
+    JPEG-encodes in one pass with no PIL round-trip; *page* is modified
+    and must come from a document that is not saved.
+    Written via a temp file and rename so concurrent readers never see
+    a partial image.
+    """
+    out_path = Path(out_path)
+    add_watermark(page)
+    pix = page.get_pixmap(dpi=dpi, alpha=False)
+    tmp_path = out_path.with_name(f"{out_path.name}.{os.urandom(8).hex()}.tmp")
+    try:
+        pix.save(str(tmp_path), output="jpeg", jpg_quality=PREVIEW_JPEG_QUALITY)
+        os.replace(tmp_path, out_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def render_preview(
+    source: str | bytes,
+    page_index: int,
+    out_path: str,
+    dpi: int | None = None,
+) -> bool:
+    """Open *source* and render one preview page.
+
+    Args:
+        source: Path to a saved result (PDF, or a single-page JPG/PNG
+            result, which is rasterised once already), or PDF bytes.
+        page_index: Zero-based page to render.
+        out_path: Destination JPEG path.
+        dpi: Render resolution; by default chosen by ``preview_dpi``.
+
+    Returns:
+        False if the page does not exist, True once the JPEG is written.
+    """
+    if isinstance(source, bytes):
+        doc = fitz.open(stream=source, filetype="pdf")
+    else:
+        doc = fitz.open(source)
+    try:
+        if page_index >= len(doc):
+            return False
+        if dpi is None:
+            dpi = preview_dpi(doc) if doc.is_pdf else PREVIEW_DPI
+        if not doc.is_pdf:
+            # Image result: wrap it in a one-page PDF so the watermark can be drawn
+            image_doc, doc = doc, fitz.open("pdf", doc.convert_to_pdf())
+            image_doc.close()
+        render_page(doc[page_index], out_path, dpi)
+        return True
+    finally:
+        doc.close()
+        release_store()
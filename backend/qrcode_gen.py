@@ -1,10 +1,9 @@
 """QR code generation for on-chain payment addresses."""
 
 import base64
+import functools
 import io
 
-import qrcode  # type: ignore[import-untyped]
-
 
 def generate_payment_qr(wallet: str, amount: str, network: str) -> str:
     """Generate a QR code as a ``data:image/png;base64,...`` string.
@@ -12,7 +11,15 @@ def generate_payment_qr(wallet: str, amount: str, network: str) -> str:
     All networks use the plain wallet address — the user selects the token
     (USDC/USDT) manually in their wallet app.
     """
-    qr_data = wallet
+    return _wallet_qr(wallet)
+
+
+@functools.lru_cache(maxsize=16)
+def _wallet_qr(qr_data: str) -> str:
+    """Encode *qr_data* as a PNG data URI (memoised: there are few wallets)."""
+    # Imported on first use: qrcode pulls in PIL, which the API process
+    # otherwise never needs until someone opens a payment
+    import qrcode  # type: ignore[import-untyped]
 
     qr = qrcode.QRCode(version=1, box_size=8, border=2)
     qr.add_data(qr_data)
@@ -22,5 +29,5 @@ def generate_payment_qr(wallet: str, amount: str, network: str) -> str:
     buf = io.BytesIO()
     img.save(buf, format="PNG")
 
-    b64 = base64.b64encode(buf.getvalue()).decode()
+    b64 = base64.b64encode(buf.getbuffer()).decode("ascii")
     return f"data:image/png;base64,{b64}"
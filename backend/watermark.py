@@ -2,74 +2,63 @@
 
 import math
 
-from PIL import Image, ImageDraw, ImageFont
+import fitz  # PyMuPDF
 
 
 def add_watermark(
-    image: Image.Image,
+    page: fitz.Page,
     text: str = "pdf-text-editor.onrender.com",
     opacity: int = 80,
-) -> Image.Image:
-    """Overlay a repeating diagonal watermark on an image.
+) -> None:
+    """Draw a repeating diagonal watermark onto a page before rasterising.
+
+    The text is added as vector content, so MuPDF renders page and
+    watermark in one pass and the pixmap can be encoded directly. Only use
+    this on a throwaway copy of the document: the page is modified.
 
     Args:
-        image: PIL Image (RGB).
+        page: Page to draw on (from a document that will not be saved).
         text: Watermark text.
         opacity: Transparency 0-255 (80 ~ 30%).
-
-    Returns:
-        New Image with watermark applied.
     """
-    base = image.convert("RGBA")
-    w, h = base.size
-
-    # Transparent overlay
-    overlay = Image.new("RGBA", (w, h), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
-
-    # Adaptive font size: ~3.5% of image width
-    font_size = max(int(w * 0.035), 14)
-    try:
-        font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", font_size)
-    except OSError:
-        try:
-            font = ImageFont.truetype("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", font_size)
-        except OSError:
-            font = ImageFont.load_default()
-
-    # Measure text
-    bbox = draw.textbbox((0, 0), text, font=font)
-    tw = bbox[2] - bbox[0]
-    th = bbox[3] - bbox[1]
-
-    # Tile spacing
-    step_x = tw + int(tw * 0.6)
-    step_y = th + 150
-
-    angle = -35
-    fill = (140, 140, 140, opacity)
-
-    # Create a larger canvas to rotate, then paste
-    diag = int(math.sqrt(w * w + h * h))
-    txt_layer = Image.new("RGBA", (diag * 2, diag * 2), (0, 0, 0, 0))
-    txt_draw = ImageDraw.Draw(txt_layer)
-
-    y = 0
-    while y < diag * 2:
-        x = 0
-        while x < diag * 2:
-            txt_draw.text((x, y), text, font=font, fill=fill)
-            x += step_x
-        y += step_y
-
-    # Rotate
-    txt_layer = txt_layer.rotate(angle, resample=Image.BICUBIC, expand=False)
-
-    # Crop center to match original size
-    cx, cy = txt_layer.size[0] // 2, txt_layer.size[1] // 2
-    crop_box = (cx - w // 2, cy - h // 2, cx + w // 2, cy + h // 2)
-    txt_layer = txt_layer.crop(crop_box).resize((w, h))
-
-    # Composite
-    result = Image.alpha_composite(base, txt_layer)
-    return result.convert("RGB")
+    # Work in unrotated page space so the tiling covers rotated pages too
+    rect = page.rect * page.derotation_matrix
+    w, h = abs(rect.width), abs(rect.height)
+    center = fitz.Point((rect.x0 + rect.x1) / 2, (rect.y0 + rect.y1) / 2)
+
+    # Adaptive font size: ~3.5% of page width
+    font_size = max(w * 0.035, 7.0)
+    tw = fitz.get_text_length(text, fontname="helv", fontsize=font_size)
+
+    # Tile spacing (72pt is ~1in of clear space between rows)
+    step_x = tw * 1.6
+    step_y = font_size + 72
+
+    # Rotate 35 degrees clockwise on screen, relative to the page as shown
+    angle = 35 - page.rotation
+    # morph applies in PDF (y-up) space, so its sense is opposite to the grid's
+    mat = fitz.Matrix(-angle)
+    cos_a, sin_a = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+
+    diag = math.hypot(w, h)
+    reach = diag / 2 + tw
+    shape = page.new_shape()
+    v = -reach
+    while v < reach:
+        u = -reach
+        while u < reach:
+            # Tile grid is laid out along the rotated axes around the centre
+            point = center + (u * cos_a - v * sin_a, u * sin_a + v * cos_a)
+            if -tw <= point.x - rect.x0 <= w + tw and -tw <= point.y - rect.y0 <= h + tw:
+                shape.insert_text(
+                    point,
+                    text,
+                    fontsize=font_size,
+                    fontname="helv",
+                    color=(140 / 255, 140 / 255, 140 / 255),
+                    fill_opacity=opacity / 255,
+                    morph=(point, mat),
+                )
+            u += step_x
+        v += step_y
+    shape.commit(overlay=True)
@@ -286,16 +286,17 @@ function showResultFromData(data) {
 
     // Preview images (with watermark)
     previewContainer.innerHTML = '';
-    if (data.preview_images && data.preview_images.length > 0) {
-        for (let i = 0; i < data.preview_images.length; i++) {
+    if (data.preview_urls && data.preview_urls.length > 0) {
+        for (let i = 0; i < data.preview_urls.length; i++) {
             const img = document.createElement('img');
-            img.src = 'data:image/jpeg;base64,' + data.preview_images[i];
+            img.src = `${API_BASE}${data.preview_urls[i]}`;
             img.alt = `Page ${i + 1}`;
+            img.loading = 'lazy';
             img.className = 'max-w-full rounded-lg border border-gray-700';
-            if (data.preview_images.length > 1) {
+            if (data.preview_urls.length > 1) {
                 const label = document.createElement('p');
                 label.className = 'text-xs text-gray-500 mb-1';
-                label.textContent = `Page ${i + 1} of ${data.preview_images.length}`;
+                label.textContent = `Page ${i + 1} of ${data.preview_urls.length}`;
                 previewContainer.appendChild(label);
             }
             previewContainer.appendChild(img);